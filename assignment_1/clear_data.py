@@ -1,3 +1,8 @@
+import argparse
+import re
+from contextlib import contextmanager
+from pathlib import Path
+
 import psycopg2
 from dotenv import load_dotenv
 import os
@@ -6,41 +11,153 @@ import time
 load_dotenv()
 
 DBNAME = os.getenv("DBNAME")
-DBUSER = os.getenv("USER")
-DBPASS = os.getenv("PASSWORD")
-DBHOST = os.getenv("HOST")
-DBPORT = os.getenv("PORT")
-
-def clear_data():
-    print("Clearing raw_tweets staging table...")
-    conn = psycopg2.connect(
-        dbname=DBNAME, user=DBUSER, password=DBPASS, host=DBHOST, port=DBPORT
-    )
+DBUSER = os.getenv("DBUSER")
+DBPASS = os.getenv("DBPASS")
+DBHOST = os.getenv("DBHOST")
+DBPORT = os.getenv("DBPORT")
+
+SCHEMA_FILE = Path(__file__).parent / "v2" / "schemas" / "database_schema.sql"
+
+# Bookkeeping tables import_data.py / import_schema.py create next to the schema
+IMPORT_TABLES = ("import_manifest", "deferred_constraints")
+STAGE_PREFIX = "merge_stage_"
+
+parser = argparse.ArgumentParser(description="Reset the imported tables for the next run")
+parser.add_argument(
+    "--mode",
+    choices=("truncate", "recreate", "template"),
+    default="truncate",
+    help="truncate: empty the existing tables; recreate: drop them and run the schema file again; "
+    "template: drop the database and copy it from --template",
+)
+parser.add_argument("--schema", default=str(SCHEMA_FILE), help="Schema file used by --mode recreate")
+parser.add_argument("--template", help="Template database used by --mode template")
+parser.add_argument(
+    "--save-template",
+    metavar="NAME",
+    help="After the reset, (re)create database NAME as a copy of the reset database for later --mode template runs",
+)
+
+TIMINGS = {}
+
+
+@contextmanager
+def step(name):
+    start = time.time()
+    yield
+    TIMINGS[name] = time.time() - start
+    print(f"Step {name}: {TIMINGS[name]:.2f} seconds")
+
+
+def connect(dbname=DBNAME):
+    conn = psycopg2.connect(dbname=dbname, user=DBUSER, password=DBPASS, host=DBHOST, port=DBPORT)
     conn.autocommit = True
-    cur = conn.cursor()
-    cur.execute("""TRUNCATE TABLE
-tweet_hashtag,
-tweet_urls,
-tweet_user_mentions,
-tweet_media,
-tweets,
-users,
-hashtags,
-places,
-raw_tweets,
-raw_text,
-failed_raw
-CASCADE;;""")
-    cur.execute("DELETE FROM raw_tweets;")
-    cur.close()
-    conn.close()
-    print("staging cleared")
+    return conn
+
+
+def schema_tables(schema_file) -> list:
+    """Tables created by the schema file, in creation order."""
+    sql = Path(schema_file).read_text(encoding="utf-8")
+    return re.findall(r"CREATE\s+(?:UNLOGGED\s+)?TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)", sql, re.I)
+
+
+def existing_tables(cur) -> set:
+    cur.execute("SELECT tablename FROM pg_tables WHERE schemaname = current_schema();")
+    return {t for (t,) in cur.fetchall()}
+
+
+def stage_tables(cur) -> list:
+    """Partitioned merge stage tables a crashed import left behind; their partitions go with them."""
+    cur.execute(
+        "SELECT relname FROM pg_class WHERE relkind = 'p' AND relname LIKE %s;",
+        (STAGE_PREFIX.replace("_", "\\_") + "%",),
+    )
+    return sorted(t for (t,) in cur.fetchall())
+
+
+def truncate(cur, schema_file) -> None:
+    """
+    Empties the schema tables and the import manifest in one TRUNCATE and
+    drops leftover merge stage tables. Keeps deferred_constraints, which
+    holds the definitions of constraints dropped by --bulk-initial.
+    """
+    with step("introspect"):
+        tables = existing_tables(cur)
+        targets = [t for t in schema_tables(schema_file) + ["import_manifest"] if t in tables]
+        stages = stage_tables(cur)
+    print(f"Truncating {len(targets)} tables: {', '.join(targets)}")
+    with step("truncate"):
+        if targets:
+            cur.execute(f"TRUNCATE TABLE {', '.join(targets)} RESTART IDENTITY CASCADE;")
+    with step("drop stage tables"):
+        for t in stages:
+            cur.execute(f"DROP TABLE IF EXISTS {t} CASCADE;")
+
+
+def recreate(cur, schema_file) -> None:
+    """
+    Drops the schema tables and all import bookkeeping tables and runs the
+    schema file again, which also restores any constraints a --bulk-initial
+    run left deferred.
+    """
+    with step("introspect"):
+        tables = existing_tables(cur)
+        targets = [t for t in schema_tables(schema_file) + list(IMPORT_TABLES) if t in tables]
+        targets += stage_tables(cur)
+    print(f"Dropping {len(targets)} tables: {', '.join(targets)}")
+    with step("drop"):
+        if targets:
+            cur.execute(f"DROP TABLE IF EXISTS {', '.join(targets)} CASCADE;")
+    with step("create"):
+        cur.execute(Path(schema_file).read_text(encoding="utf-8"))
+
+
+def copy_database(source, target) -> None:
+    """
+    Replaces database target with a copy of source. CREATE DATABASE ...
+    TEMPLATE needs both without other sessions, so those are terminated.
+    """
+    conn = connect("postgres")
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1 FROM pg_database WHERE datname = %s;", (source,))
+            if cur.fetchone() is None:
+                raise SystemExit(f"Database {source} does not exist, {target} left as is")
+            with step(f"disconnect {source}, {target}"):
+                cur.execute(
+                    "SELECT pg_terminate_backend(pid) FROM pg_stat_activity "
+                    "WHERE datname IN (%s, %s) AND pid <> pg_backend_pid();",
+                    (source, target),
+                )
+            with step(f"drop {target}"):
+                cur.execute(f'DROP DATABASE IF EXISTS "{target}";')
+            with step(f"create {target} from {source}"):
+                cur.execute(f'CREATE DATABASE "{target}" TEMPLATE "{source}";')
+    finally:
+        conn.close()
 
 
 if __name__ == "__main__":
+    args = parser.parse_args()
     start = time.time()
-    
-    clear_data()
+
+    if args.mode == "template":
+        if not args.template:
+            parser.error("--mode template needs --template")
+        copy_database(args.template, DBNAME)
+    else:
+        conn = connect()
+        try:
+            with conn.cursor() as cur:
+                if args.mode == "truncate":
+                    truncate(cur, args.schema)
+                else:
+                    recreate(cur, args.schema)
+        finally:
+            conn.close()
+
+    if args.save_template:
+        copy_database(DBNAME, args.save_template)
 
     end = time.time()
-    print(f"Time taken to clear staging: {end - start} seconds")
\ No newline at end of file
+    print(f"Time taken to reset ({args.mode}): {end - start:.2f} seconds")
@@ -0,0 +1,1100 @@
+"""
+Micro-benchmarks for the import pipeline in import_data.py.
+
+    python bench_import.py copy-format --input data/file.jsonl --limit 50000 [--db]
+    python bench_import.py parse --tweets 20000 --output results/parse.json
+    python bench_import.py tmp-index --tweets 20000 [--input data/file.jsonl] [--partitions 4]
+    python bench_import.py gz-read --input data/*.jsonl.gz [--loads]
+    python bench_import.py row-builders --tweets 20000 [--input data/file.jsonl]
+    python bench_import.py timestamps --tweets 50000
+
+parse runs on synthetic tweets from a seeded generator, so results of two
+checkouts are comparable; --compare prints the change against an earlier
+results file.
+"""
+
+import argparse
+import gc
+import gzip
+import io
+import itertools
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import orjson
+import psycopg2
+
+import import_data
+from import_data import (
+    DB_DSN,
+    GZ_READERS,
+    ROW_BUILDERS,
+    ROW_SPECS,
+    TABLE_COLUMNS,
+    TIMESTAMP_FORMATS,
+    TMP_INDEX_MAP,
+    TMP_INDEX_STRATEGIES,
+    _make_table_writer,
+    copy_sql_for,
+    PARTITION_KEYS,
+    create_stage_table,
+    create_tmp_table,
+    extract_from_tweet,
+    hashtag_id_from_tag,
+    git_commit,
+    gz_reader_available,
+    iter_input_lines,
+    merge_stage_table,
+    merge_tmp_table,
+    process_file_worker,
+    sanitize_text,
+    use_timestamp_format,
+)
+
+
+def load_rows(path: str, limit: int) -> Dict[str, List[Tuple]]:
+    rows = defaultdict(list)
+    for _, line in itertools.islice(iter_input_lines(path), limit):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            tweet = orjson.loads(line)
+        except orjson.JSONDecodeError:
+            continue
+        for t, r in extract_from_tweet(tweet).items():
+            rows[t].extend(r)
+    return rows
+
+
+def encode_rows(rows: Dict[str, List[Tuple]], copy_format: str) -> Tuple[Dict[str, bytes], float]:
+    """Encode every table with the worker writer for copy_format; returns payloads and seconds."""
+    import_data.WORKER_OPTIONS["copy_format"] = copy_format
+    payloads = {}
+    t0 = time.perf_counter()
+    for t, table_rows in rows.items():
+        if copy_format == "binary":
+            f = io.BytesIO()
+            writer = _make_table_writer(f, t)
+            writer.writerows(table_rows)
+            writer.finish()
+            payloads[t] = f.getvalue()
+        else:
+            f = io.StringIO()
+            _make_table_writer(f, t).writerows(table_rows)
+            payloads[t] = f.getvalue().encode("utf-8")
+    return payloads, time.perf_counter() - t0
+
+
+def copy_payloads(db_dsn: str, payloads: Dict[str, bytes], copy_format: str) -> float:
+    """COPY each payload into a fresh temp table; returns server-side seconds."""
+    import_data.MERGE_OPTIONS["copy_format"] = copy_format
+    conn = psycopg2.connect(db_dsn)
+    try:
+        cur = conn.cursor()
+        elapsed = 0.0
+        for t, data in payloads.items():
+            tmp = f"bench_{t}"
+            cur.execute(f"CREATE TEMP TABLE {tmp} (LIKE {t} INCLUDING DEFAULTS)")
+            t0 = time.perf_counter()
+            cur.copy_expert(copy_sql_for(tmp, t), io.BytesIO(data))
+            elapsed += time.perf_counter() - t0
+        conn.rollback()
+        return elapsed
+    finally:
+        conn.close()
+
+
+def bench_copy_format(args):
+    rows = load_rows(args.input, args.limit)
+    total_rows = sum(len(r) for r in rows.values())
+    print(f"Loaded {total_rows} rows over {len(rows)} tables from {args.input}")
+    for copy_format in ("csv", "binary"):
+        best = None
+        for _ in range(args.repeat):
+            payloads, seconds = encode_rows(rows, copy_format)
+            best = seconds if best is None else min(best, seconds)
+        size = sum(len(p) for p in payloads.values())
+        line = (
+            f"{copy_format:>6}: encode {best:.3f}s "
+            f"({total_rows / best:,.0f} rows/s, {size / best / 2**20:.1f} MB/s, {size / 2**20:.1f} MB)"
+        )
+        if args.db:
+            server = copy_payloads(DB_DSN, payloads, copy_format)
+            line += f", COPY {server:.3f}s ({total_rows / server:,.0f} rows/s)"
+        print(line)
+
+
+# ---------- synthetic tweets ----------
+WORDS = (
+    "covid vaccine lockdown mask news today people world health data "
+    "ľudia správy očkovanie 🦠 😷 https://t.co/x"
+).split()
+
+
+class TweetGenerator:
+    """
+    Seeded generator of API v1.1 style tweets. The ratios control how often
+    a tweet is a retweet, quotes another tweet, carries media or has long
+    text; hashtags is the mean number of hashtags per tweet.
+    """
+
+    def __init__(
+        self,
+        seed: int = 1,
+        retweet_ratio: float = 0.4,
+        quote_ratio: float = 0.1,
+        hashtags: float = 1.5,
+        media_ratio: float = 0.2,
+        long_text_ratio: float = 0.3,
+        users: int = 50_000,
+    ):
+        self.rnd = random.Random(seed)
+        self.retweet_ratio = retweet_ratio
+        self.quote_ratio = quote_ratio
+        self.hashtags = hashtags
+        self.media_ratio = media_ratio
+        self.long_text_ratio = long_text_ratio
+        self.users = users
+        self.next_id = 1_200_000_000_000_000_000
+        self.start = datetime(2020, 3, 1)
+
+    def _text(self, words: int) -> str:
+        return " ".join(self.rnd.choice(WORDS) for _ in range(words))
+
+    def _created_at(self) -> str:
+        ts = self.start + timedelta(seconds=self.rnd.randrange(90 * 86400))
+        return ts.strftime("%a %b %d %H:%M:%S +0000 %Y")
+
+    def _user(self) -> Dict[str, Any]:
+        uid = self.rnd.randrange(1, self.users)
+        return {
+            "id": uid,
+            "id_str": str(uid),
+            "screen_name": f"user{uid}",
+            "name": f"User {uid}",
+            "description": self._text(12),
+            "verified": uid % 50 == 0,
+            "protected": False,
+            "followers_count": self.rnd.randrange(10_000),
+            "friends_count": self.rnd.randrange(1_000),
+            "statuses_count": self.rnd.randrange(100_000),
+            "created_at": self._created_at(),
+            "location": "Bratislava" if uid % 3 else None,
+            "url": None,
+        }
+
+    def tweet(self, nested: bool = False) -> Dict[str, Any]:
+        rnd = self.rnd
+        self.next_id += 1
+        tid = self.next_id
+        long_text = rnd.random() < self.long_text_ratio
+        text = self._text(45 if long_text else 12)
+        n_tags = int(rnd.expovariate(1 / self.hashtags)) if self.hashtags else 0
+        tweet = {
+            "id": tid,
+            "id_str": str(tid),
+            "created_at": self._created_at(),
+            "full_text": text,
+            "display_text_range": [0, len(text)],
+            "lang": "en",
+            "source": '<a href="http://twitter.com">Twitter Web App</a>',
+            "user": self._user(),
+            "retweet_count": rnd.randrange(500),
+            "favorite_count": rnd.randrange(2_000),
+            "possibly_sensitive": False,
+            "entities": {
+                "hashtags": [{"text": f"tag{rnd.randrange(5_000)}"} for _ in range(n_tags)],
+                "urls": [{"url": "https://t.co/abc", "expanded_url": "https://example.com/a"}],
+                "user_mentions": [
+                    {"id": rnd.randrange(1, self.users), "screen_name": "m", "name": "M"}
+                ],
+            },
+        }
+        if rnd.random() < 0.05:
+            tweet["place"] = {
+                "id": f"{rnd.randrange(200):016x}",
+                "full_name": "Bratislava, Slovakia",
+                "country": "Slovakia",
+                "country_code": "SK",
+                "place_type": "city",
+            }
+        if rnd.random() < self.media_ratio:
+            tweet["extended_entities"] = {
+                "media": [
+                    {
+                        "id": tid + 1,
+                        "type": "photo",
+                        "media_url": "http://pbs.twimg.com/media/x.jpg",
+                        "media_url_https": "https://pbs.twimg.com/media/x.jpg",
+                        "display_url": "pic.twitter.com/x",
+                        "expanded_url": "https://twitter.com/x/status/1/photo/1",
+                    }
+                ]
+            }
+        if not nested:
+            if rnd.random() < self.retweet_ratio:
+                tweet["retweeted_status"] = self.tweet(nested=True)
+            elif rnd.random() < self.quote_ratio:
+                tweet["quoted_status"] = self.tweet(nested=True)
+                tweet["quoted_status_id"] = tweet["quoted_status"]["id"]
+        return tweet
+
+    def lines(self, count: int) -> List[bytes]:
+        return [orjson.dumps(self.tweet()) for _ in range(count)]
+
+
+# ---------- parse benchmark ----------
+def _text_values(tweet: Dict[str, Any]) -> List[Any]:
+    """The values extract_from_tweet passes through sanitize_text, roughly."""
+    user = tweet.get("user") or {}
+    values = [tweet.get("full_text"), tweet.get("lang"), tweet.get("source")]
+    values += [user.get(k) for k in ("screen_name", "name", "description", "location", "url")]
+    for key in ("retweeted_status", "quoted_status"):
+        if tweet.get(key):
+            values += _text_values(tweet[key])
+    return values
+
+
+def _best_of(repeat: int, fn: Callable[[], Any]) -> float:
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def transient_bytes_per_tweet(tweets: List[Dict[str, Any]], batch_size: int = 1000) -> float:
+    """
+    Mean tracemalloc high-water mark above the live memory while one tweet
+    is extracted into the worker style row batches, i.e. what the hot loop
+    allocates per tweet on top of the rows it keeps.
+    """
+    import_data.WORKER_OPTIONS["copy_format"] = "csv"
+    batches = {t: [] for t in import_data.TABLE_COLS}
+    writers = {t: _make_table_writer(io.StringIO(), t) for t in batches}
+    total = 0
+    tracemalloc.start()
+    try:
+        for i, tweet in enumerate(tweets, 1):
+            current = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            extract_from_tweet(tweet, rows=batches)
+            if i % batch_size == 0:
+                for t, batch in batches.items():
+                    writers[t].writerows(batch)
+                    batch.clear()
+            total += tracemalloc.get_traced_memory()[1] - current
+    finally:
+        tracemalloc.stop()
+    return total / max(len(tweets), 1)
+
+
+def bench_parse(args):
+    gen = TweetGenerator(
+        seed=args.seed,
+        retweet_ratio=args.retweet_ratio,
+        quote_ratio=args.quote_ratio,
+        hashtags=args.hashtags,
+        media_ratio=args.media_ratio,
+        long_text_ratio=args.long_text_ratio,
+    )
+    lines = gen.lines(args.tweets)
+    input_bytes = sum(len(l) + 1 for l in lines)
+    tweets = [orjson.loads(l) for l in lines]
+    texts = [v for t in tweets for v in _text_values(t)]
+    rows = {t: [] for t in import_data.TABLE_COLS}
+    for t in tweets:
+        extract_from_tweet(t, rows=rows)
+    import_data.WORKER_OPTIONS["copy_format"] = "csv"
+
+    def write_csv():
+        for t, table_rows in rows.items():
+            _make_table_writer(io.StringIO(), t).writerows(table_rows)
+
+    stages = {
+        "orjson_loads": lambda: [orjson.loads(l) for l in lines],
+        "extract_from_tweet": lambda: [extract_from_tweet(t) for t in tweets],
+        "sanitize_text": lambda: [sanitize_text(v) for v in texts],
+        "csv_write": write_csv,
+    }
+
+    with tempfile.TemporaryDirectory(prefix="bench_import_") as tmp:
+        path = os.path.join(tmp, "tweets.jsonl")
+        with open(path, "wb") as fh:
+            fh.write(b"\n".join(lines) + b"\n")
+        out_dir = os.path.join(tmp, "out")
+        stages["process_file_worker"] = lambda: process_file_worker((path, 0, out_dir))
+
+        results = {}
+        for name, fn in stages.items():
+            seconds = _best_of(args.repeat, fn)
+            results[name] = {
+                "seconds": round(seconds, 4),
+                "tweets_per_s": round(args.tweets / seconds),
+                "mb_per_s": round(input_bytes / seconds / 2**20, 2),
+            }
+            print(
+                f"{name:>20}: {seconds:.3f}s  {args.tweets / seconds:>10,.0f} tweets/s  "
+                f"{input_bytes / seconds / 2**20:7.1f} MB/s"
+            )
+
+    if args.allocations:
+        per_tweet = transient_bytes_per_tweet(tweets)
+        results["allocations"] = {"transient_bytes_per_tweet": round(per_tweet, 1)}
+        print(f"{'allocations':>20}: {per_tweet:,.0f} transient bytes per tweet")
+
+    report = {
+        "benchmark": "parse",
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "config": {
+            k: getattr(args, k)
+            for k in (
+                "tweets",
+                "seed",
+                "repeat",
+                "retweet_ratio",
+                "quote_ratio",
+                "hashtags",
+                "media_ratio",
+                "long_text_ratio",
+            )
+        },
+        "input_bytes": input_bytes,
+        "rows": {t: len(r) for t, r in rows.items()},
+        "results": results,
+    }
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as fh:
+            baseline = json.load(fh)
+        print(f"\nCompared to {args.compare} ({baseline.get('commit') or 'unknown commit'}):")
+        for name, r in results.items():
+            old = baseline.get("results", {}).get(name)
+            if old and "tweets_per_s" in r:
+                change = (r["tweets_per_s"] / old["tweets_per_s"] - 1) * 100
+                print(f"{name:>20}: {change:+6.1f}% tweets/s")
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, indent=2)
+        print(f"Results written to {args.output}")
+
+
+# ---------- temp table index strategies ----------
+def _time_strategy(cur, table_name: str, preload: bytes, data: bytes) -> Tuple[float, float]:
+    """
+    COPY and merge seconds of data into a session-local shadow of table_name
+    (same columns and indexes, without foreign keys) that already holds the
+    preload rows. The caller rolls the transaction back.
+    """
+    index_cols = TMP_INDEX_MAP.get(table_name)
+    cur.execute(f"CREATE TEMP TABLE {table_name} (LIKE {table_name} INCLUDING ALL);")
+    if preload:
+        tmp = create_tmp_table(cur, table_name)
+        cur.copy_expert(copy_sql_for(tmp, table_name), io.BytesIO(preload))
+        merge_tmp_table(cur, table_name)
+
+    t0 = time.perf_counter()
+    tmp = create_tmp_table(cur, table_name, index_cols)
+    cur.copy_expert(copy_sql_for(tmp, table_name), io.BytesIO(data))
+    t1 = time.perf_counter()
+    merge_tmp_table(cur, table_name, None, index_cols)
+    return t1 - t0, time.perf_counter() - t1
+
+
+# partitioned merges commit their staging table and merge on other
+# connections, so they run against shadow tables in this scratch schema
+BENCH_SCHEMA = "bench_tmp_index"
+
+
+def _time_partitioned(table_name: str, preload: bytes, data: bytes) -> Tuple[float, float]:
+    """
+    COPY and merge seconds of data through a partitioned staging table
+    (--merge-partitions) into a shadow of table_name in BENCH_SCHEMA that
+    already holds the preload rows. The shadow is dropped afterwards.
+    """
+    dsn = f"{DB_DSN} options='-c search_path={BENCH_SCHEMA},public'"
+    index_cols = TMP_INDEX_MAP.get(table_name)
+    conn = psycopg2.connect(dsn)
+    try:
+        cur = conn.cursor()
+        cur.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE; CREATE SCHEMA {BENCH_SCHEMA};")
+        cur.execute(f"CREATE TABLE {table_name} (LIKE public.{table_name} INCLUDING ALL);")
+        if preload:
+            tmp = create_tmp_table(cur, table_name)
+            cur.copy_expert(copy_sql_for(tmp, table_name), io.BytesIO(preload))
+            merge_tmp_table(cur, table_name)
+        conn.commit()
+
+        t0 = time.perf_counter()
+        stage = create_stage_table(cur, table_name, index_cols)
+        cur.copy_expert(copy_sql_for(stage, table_name), io.BytesIO(data))
+        conn.commit()
+        t1 = time.perf_counter()
+        merge_stage_table(dsn, table_name, stage, None, index_cols)
+        return t1 - t0, time.perf_counter() - t1
+    finally:
+        conn.rollback()
+        conn.cursor().execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE;")
+        conn.commit()
+        conn.close()
+
+
+def bench_tmp_index(args):
+    if args.input:
+        rows = load_rows(args.input, args.tweets)
+    else:
+        gen = TweetGenerator(seed=args.seed)
+        rows = {t: [] for t in import_data.TABLE_COLS}
+        for line in gen.lines(args.tweets):
+            extract_from_tweet(orjson.loads(line), rows=rows)
+    import_data.MERGE_OPTIONS["mode"] = args.merge_mode
+    import_data.MERGE_OPTIONS["copy_format"] = "csv"
+    import_data.MERGE_OPTIONS["partitions"] = args.partitions
+    payloads, _ = encode_rows(rows, "csv")
+    preloads, _ = encode_rows(
+        {t: r[: int(len(r) * args.preload)] for t, r in rows.items()}, "csv"
+    )
+    tables = args.tables.split(",") if args.tables else list(payloads)
+    strategies = args.strategies.split(",") if args.strategies else TMP_INDEX_STRATEGIES
+
+    partitioned = f", {args.partitions} merge partitions" if args.partitions > 1 else ""
+    print(
+        f"{sum(len(r) for r in rows.values())} rows, target preloaded with "
+        f"{args.preload:.0%} of them{partitioned}, best of {args.repeat}"
+    )
+    print(f"{'table':>20} {'strategy':>12} {'copy s':>8} {'merge s':>8} {'total s':>8}")
+    results = {}
+    conn = psycopg2.connect(DB_DSN)
+    try:
+        cur = conn.cursor()
+        for t in tables:
+            results[t] = {}
+            for strategy in strategies:
+                import_data.MERGE_OPTIONS["tmp_index"] = {t: strategy}
+                best = None
+                for _ in range(args.repeat):
+                    if args.partitions > 1 and t in PARTITION_KEYS:
+                        copy_s, merge_s = _time_partitioned(t, preloads.get(t), payloads[t])
+                    else:
+                        try:
+                            copy_s, merge_s = _time_strategy(cur, t, preloads.get(t), payloads[t])
+                        finally:
+                            conn.rollback()
+                    if best is None or copy_s + merge_s < sum(best):
+                        best = (copy_s, merge_s)
+                results[t][strategy] = {"copy_seconds": round(best[0], 4), "merge_seconds": round(best[1], 4)}
+                print(f"{t:>20} {strategy:>12} {best[0]:8.3f} {best[1]:8.3f} {sum(best):8.3f}")
+            fastest = min(results[t], key=lambda st: sum(results[t][st].values()))
+            print(f"{t:>20} {'-> ' + fastest:>12}")
+    finally:
+        conn.close()
+
+    if args.output:
+        report = {
+            "benchmark": "tmp-index",
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "config": {
+                k: getattr(args, k)
+                for k in ("input", "tweets", "seed", "preload", "merge_mode", "partitions", "repeat")
+            },
+            "rows": {t: len(r) for t, r in rows.items()},
+            "results": results,
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, indent=2)
+        print(f"Results written to {args.output}")
+
+
+# ---------- gzip read path ----------
+def _read_text(path: str, loads: bool) -> Tuple[int, int]:
+    """The read path before the bytes rewrite: text mode, decoded and encoded again."""
+    lines = nbytes = 0
+    with gzip.open(path, "rt", encoding="utf-8", errors="replace") as fh:
+        for raw in fh:
+            nbytes += len(raw)
+            line = raw.strip()
+            if not line:
+                continue
+            lines += 1
+            data = line.replace("\x00", "").encode("utf-8")
+            if loads:
+                try:
+                    orjson.loads(data)
+                except orjson.JSONDecodeError:
+                    pass
+    return lines, nbytes
+
+
+def _read_bytes(path: str, loads: bool, reader: str) -> Tuple[int, int]:
+    """What the worker does with an input before extract_from_tweet."""
+    import_data.WORKER_OPTIONS["gz_reader"] = reader
+    lines = nbytes = 0
+    for _, raw in iter_input_lines(path):
+        nbytes += len(raw) + 1
+        line = raw.strip()
+        if not line:
+            continue
+        lines += 1
+        data = line.replace(b"\x00", b"")
+        if loads:
+            try:
+                orjson.loads(data)
+            except orjson.JSONDecodeError:
+                pass
+    return lines, nbytes
+
+
+def _cpu_seconds() -> float:
+    """CPU time of this process and its waited-for children (pigz)."""
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return time.process_time() + children.ru_utime + children.ru_stime
+
+
+def bench_gz_read(args):
+    paths = args.input
+    tmp = None
+    if not paths:
+        tmp = tempfile.TemporaryDirectory(prefix="bench_import_")
+        path = os.path.join(tmp.name, "tweets.jsonl.gz")
+        with gzip.open(path, "wb") as fh:
+            fh.write(b"\n".join(TweetGenerator(seed=args.seed).lines(args.tweets)) + b"\n")
+        paths = [path]
+
+    readers = {"text (before)": lambda p: _read_text(p, args.loads)}
+    for r in GZ_READERS:
+        if gz_reader_available(r):
+            readers[f"bytes {r}"] = lambda p, r=r: _read_bytes(p, args.loads, r)
+
+    compressed = sum(os.path.getsize(p) for p in paths)
+    print(
+        f"{len(paths)} files, {compressed / 2**20:.1f} MB compressed"
+        f"{', with orjson.loads' if args.loads else ''}, best of {args.repeat}"
+    )
+    for r in GZ_READERS:
+        if not gz_reader_available(r):
+            print(f"{'bytes ' + r:>16}: not available")
+    results = {}
+    try:
+        for name, read in readers.items():
+            best = None
+            for _ in range(args.repeat):
+                wall0, cpu0 = time.perf_counter(), _cpu_seconds()
+                counts = [read(p) for p in paths]
+                run = (time.perf_counter() - wall0, _cpu_seconds() - cpu0)
+                if best is None or run[0] < best[0]:
+                    best = run
+            lines = sum(c[0] for c in counts)
+            mb = sum(c[1] for c in counts) / 2**20
+            wall, cpu = best
+            results[name] = {
+                "lines": lines,
+                "seconds": round(wall, 4),
+                "cpu_seconds": round(cpu, 4),
+                "mb_per_s": round(mb / wall, 2),
+                "mb_per_cpu_s": round(mb / cpu, 2) if cpu else None,
+            }
+            print(
+                f"{name:>16}: {wall:.3f}s  {mb / wall:7.1f} MB/s  "
+                f"{mb / cpu if cpu else 0:7.1f} MB/s per core  ({lines} lines)"
+            )
+    finally:
+        if tmp is not None:
+            tmp.cleanup()
+
+    if args.output:
+        report = {
+            "benchmark": "gz-read",
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "config": {k: getattr(args, k) for k in ("input", "tweets", "seed", "loads", "repeat")},
+            "compressed_bytes": compressed,
+            "results": results,
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, indent=2)
+        print(f"Results written to {args.output}")
+
+
+# ---------- generated row builders ----------
+# Frozen copy of the hand-written extraction the generated row builders
+# replaced, as the baseline they are timed and checked against. Do not
+# update it along with import_data.py.
+def _v1_user_row(user: Dict[str, Any], snapshot_at: Optional[str]) -> Tuple:
+    return (
+        int(user.get("id") or user.get("id_str") or 0),
+        sanitize_text(user.get("screen_name")),
+        sanitize_text(user.get("name")),
+        sanitize_text(user.get("description")),
+        user.get("verified"),
+        user.get("protected"),
+        user.get("followers_count"),
+        user.get("friends_count"),
+        user.get("statuses_count"),
+        user.get("created_at"),
+        sanitize_text(user.get("location")),
+        sanitize_text(user.get("url")),
+        snapshot_at,
+    )
+
+
+def extract_from_tweet_v1(
+    tweet: Dict[str, Any],
+    snapshot_at: Optional[str] = None,
+    rows: Optional[Dict[str, List[Tuple]]] = None,
+) -> Dict[str, List[Tuple]]:
+    """extract_from_tweet before the row builders, without the seen cache."""
+    if rows is None:
+        rows = {t: [] for t in import_data.TABLE_COLUMNS}
+
+    tid = tweet.get("id") or tweet.get("id_str")
+    if tid is None:
+        return rows
+    tid = int(tid)
+    if snapshot_at is None:
+        snapshot_at = tweet.get("created_at")
+
+    user = tweet.get("user")
+    if user:
+        rows["users"].append(_v1_user_row(user, snapshot_at))
+
+    place = tweet.get("place")
+    if place:
+        rows["places"].append(
+            (
+                sanitize_text(place.get("id")),
+                sanitize_text(place.get("full_name")),
+                sanitize_text(place.get("country")),
+                sanitize_text(place.get("country_code")),
+                sanitize_text(place.get("place_type")),
+            )
+        )
+
+    def get_full_text(t: dict):
+        if t.get("full_text"):
+            return t["full_text"]
+        ext = t.get("extended_tweet") or {}
+        if ext.get("full_text"):
+            return ext["full_text"]
+
+        return t.get("text") or ""
+
+    display_from, display_to = None, None
+    dtr = tweet.get("display_text_range")
+    if isinstance(dtr, (list, tuple)) and len(dtr) >= 2:
+        display_from, display_to = int(dtr[0]), int(dtr[1])
+
+    tweet_row = (
+        tid,
+        tweet.get("created_at"),
+        sanitize_text(get_full_text(tweet)),
+        display_from,
+        display_to,
+        sanitize_text(tweet.get("lang")),
+        int(user.get("id") or user.get("id_str")) if user else None,
+        sanitize_text(tweet.get("source")),
+        (
+            int(tweet.get("in_reply_to_status_id"))
+            if tweet.get("in_reply_to_status_id")
+            else None
+        ),
+        int(tweet.get("quoted_status_id")) if tweet.get("quoted_status_id") else None,
+        (
+            int(tweet.get("retweeted_status", {}).get("id"))
+            if tweet.get("retweeted_status", {}).get("id")
+            else None
+        ),
+        sanitize_text(place.get("id") if place else None),
+        tweet.get("retweet_count"),
+        tweet.get("favorite_count"),
+        tweet.get("possibly_sensitive"),
+    )
+    rows["tweets"].append(tweet_row)
+
+    entities = tweet.get("entities") or {}
+    for h in entities.get("hashtags", []):
+        tag_text = h.get("text") or h.get("tag")
+        if not tag_text:
+            continue
+        tag_norm = tag_text.strip()
+        hid = hashtag_id_from_tag(tag_norm)
+        rows["hashtags"].append((hid, sanitize_text(tag_norm)))
+        rows["tweet_hashtag"].append((tid, hid))
+
+    for u in entities.get("urls", []):
+        rows["tweet_urls"].append(
+            (
+                tid,
+                sanitize_text(u.get("url")),
+                sanitize_text(u.get("expanded_url")),
+                sanitize_text(u.get("display_url")),
+                sanitize_text(u.get("unwound_url") or u.get("expanded_url")),
+            )
+        )
+
+    for m in entities.get("user_mentions", []):
+        mid = m.get("id") or m.get("id_str")
+        if not mid:
+            continue
+        rows["tweet_user_mentions"].append(
+            (
+                tid,
+                int(mid),
+                sanitize_text(m.get("screen_name")),
+                sanitize_text(m.get("name")),
+            )
+        )
+
+    media_block = (
+        (tweet.get("extended_entities") or {}).get("media")
+        or entities.get("media")
+        or []
+    )
+
+    for mm in media_block:
+        rows["tweet_media"].append(
+            (
+                tid,
+                int(mm.get("id") or mm.get("id_str")) or None,
+                sanitize_text(mm.get("type")),
+                sanitize_text(mm.get("media_url")),
+                sanitize_text(mm.get("media_url_https")),
+                sanitize_text(mm.get("display_url")),
+                sanitize_text(mm.get("expanded_url")),
+            )
+        )
+
+    for key in ("retweeted_status", "quoted_status"):
+        sub = tweet.get(key)
+        if sub and isinstance(sub, dict) and (sub.get("id") or sub.get("id_str")):
+            extract_from_tweet_v1(sub, snapshot_at, rows)
+
+    return rows
+
+
+def _interleaved_best(repeat: int, fns: Dict[str, Callable[[], Any]]) -> Dict[str, float]:
+    """
+    Best seconds of each fn, runs alternating so machine noise hits all of
+    them alike. The collector is off while timing, as in the import workers.
+    """
+    best = {}
+    try:
+        for _ in range(repeat):
+            for name, fn in fns.items():
+                gc.collect()
+                gc.disable()
+                t0 = time.perf_counter()
+                fn()
+                elapsed = time.perf_counter() - t0
+                gc.enable()
+                best[name] = min(best.get(name, elapsed), elapsed)
+    finally:
+        gc.enable()
+    return best
+
+
+ROW_COERCE = {
+    "raw": lambda v: v,
+    "text": sanitize_text,
+    "int": lambda v: None if v is None else int(v),
+    "id": lambda v: int(v) if v else None,
+    "timestamp": lambda v: v,  # ROW_BUILDERS are compiled for --timestamps raw
+}
+
+
+def _resolve(record: Any, path: str) -> Any:
+    for key in path.split("."):
+        if key.isdigit():
+            i = int(key)
+            record = record[i] if isinstance(record, list) and len(record) > i else None
+        else:
+            record = record.get(key) if isinstance(record, dict) else None
+    return record
+
+
+def interpreted_builder(table_name: str) -> Callable[..., Tuple]:
+    """
+    Row builder walking ROW_SPECS[table_name] for every row, the generic
+    code the generated builders replace; same arguments and rows.
+    """
+    spec = ROW_SPECS[table_name]
+    params = list(dict.fromkeys(src[1:] for _, src, _, _ in spec if src.startswith("@")))
+    uses_record = any(not src.startswith("@") for _, src, _, _ in spec)
+
+    def build(*args):
+        record = args[0] if uses_record else None
+        values = dict(zip(params, args[uses_record:]))
+        row = []
+        for _, src, coercion, _ in spec:
+            if src.startswith("@"):
+                v = values[src[1:]]
+            else:
+                v = None
+                for alt in src.split("|"):
+                    v = _resolve(record, alt)
+                    if v:
+                        break
+            row.append(ROW_COERCE[coercion](v))
+        return tuple(row)
+
+    return build
+
+
+def builder_calls(tweets: List[Dict[str, Any]]) -> Dict[str, List[Tuple]]:
+    """Arguments of every row builder call extract_from_tweet makes for tweets, per table."""
+    calls = defaultdict(list)
+    saved = dict(ROW_BUILDERS), import_data._build_user
+
+    def recorder(t, build):
+        def record(*args):
+            calls[t].append(args)
+            return build(*args)
+
+        return record
+
+    for t, build in saved[0].items():
+        ROW_BUILDERS[t] = recorder(t, build)
+    import_data._build_user = ROW_BUILDERS["users"]
+    try:
+        for tweet in tweets:
+            extract_from_tweet(tweet)
+    finally:
+        ROW_BUILDERS.update(saved[0])
+        import_data._build_user = saved[1]
+    return calls
+
+
+def bench_row_builders(args):
+    if args.input:
+        tweets = []
+        for _, line in iter_input_lines(args.input):
+            try:
+                tweets.append(orjson.loads(line))
+            except orjson.JSONDecodeError:
+                continue
+            if len(tweets) == args.tweets:
+                break
+        source = f"{len(tweets)} tweets of {args.input}"
+    else:
+        gen = TweetGenerator(seed=args.seed)
+        tweets = [orjson.loads(line) for line in gen.lines(args.tweets)]
+        source = f"{len(tweets)} synthetic tweets"
+    use_timestamp_format("raw")
+
+    # the generated builders must reproduce the hand-written rows exactly
+    for tweet in tweets:
+        before, after = extract_from_tweet_v1(tweet), extract_from_tweet(tweet)
+        for t in TABLE_COLUMNS:
+            if before[t] != after[t]:
+                raise SystemExit(
+                    f"{t} rows of tweet {tweet.get('id')} differ:\n"
+                    f"  hand-written {before[t]!r}\n  generated    {after[t]!r}"
+                )
+    print(f"{source}: rows of the generated builders equal the hand-written ones")
+
+    print(f"best of {args.repeat}, interleaved")
+    extract = _interleaved_best(
+        args.repeat,
+        {
+            "hand-written": lambda: [extract_from_tweet_v1(tw) for tw in tweets],
+            "generated": lambda: [extract_from_tweet(tw) for tw in tweets],
+        },
+    )
+    for name, sec in extract.items():
+        print(f"{'extract ' + name:>22}: {sec:.3f}s  {len(tweets) / sec:,.0f} tweets/s")
+    speedup = extract["hand-written"] / extract["generated"]
+    print(f"{'generated vs before':>22}: {speedup:.2f}x")
+
+    calls = builder_calls(tweets)
+    results = {}
+    totals = [0.0, 0.0]
+    for t in ROW_SPECS:
+        t_calls = calls.get(t, [])
+        generated, interpreted = ROW_BUILDERS[t], interpreted_builder(t)
+        for a in t_calls:
+            if generated(*a) != interpreted(*a):
+                raise SystemExit(f"{t}: generated and interpreted rows differ for {a!r}")
+        gen_s = _best_of(args.repeat, lambda: [generated(*a) for a in t_calls])
+        int_s = _best_of(args.repeat, lambda: [interpreted(*a) for a in t_calls])
+        totals[0] += gen_s
+        totals[1] += int_s
+        results[t] = {"rows": len(t_calls), "generated_seconds": round(gen_s, 4), "interpreted_seconds": round(int_s, 4)}
+        print(
+            f"{t:>20}: {len(t_calls):8d} rows  generated {gen_s:.3f}s  "
+            f"interpreted {int_s:.3f}s  ({int_s / gen_s if gen_s else 0:.1f}x)"
+        )
+    print(f"{'all tables':>20}: generated {totals[0]:.3f}s  interpreted {totals[1]:.3f}s")
+
+    if args.output:
+        report = {
+            "benchmark": "row-builders",
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "config": {k: getattr(args, k) for k in ("input", "tweets", "seed", "repeat")},
+            "extract_seconds": {name: round(sec, 4) for name, sec in extract.items()},
+            "builders": results,
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, indent=2)
+        print(f"Results written to {args.output}")
+
+
+# ---------- timestamp formats ----------
+def bench_timestamps(args):
+    """
+    Worker seconds (extract and encode) and server COPY seconds of the
+    timestamp tables for every valid --copy-format / --timestamps pair.
+    """
+    gen = TweetGenerator(seed=args.seed)
+    tweets = [orjson.loads(line) for line in gen.lines(args.tweets)]
+    tables = args.tables.split(",")
+    copy_formats = ("csv", "binary")
+
+    print(f"{args.tweets} synthetic tweets, tables {', '.join(tables)}, best of {args.repeat}")
+    results = {}
+    try:
+        for copy_format in copy_formats:
+            for ts in TIMESTAMP_FORMATS:
+                if ts == "epoch" and copy_format == "csv":
+                    continue
+                use_timestamp_format(ts)
+                rows = defaultdict(list)
+
+                def extract():
+                    # a fresh memo per run, as in a new worker
+                    import_data.twitter_ts_to_iso.cache_clear()
+                    import_data.timestamp_to_pg_micros.cache_clear()
+                    rows.clear()
+                    for tweet in tweets:
+                        extract_from_tweet(tweet, rows=rows)
+
+                extract_s = _best_of(args.repeat, extract)
+                payloads, encode_s = encode_rows({t: rows[t] for t in tables}, copy_format)
+                copy_s = min(copy_payloads(DB_DSN, payloads, copy_format) for _ in range(args.repeat))
+                name = f"{copy_format} {ts}"
+                results[name] = {
+                    "extract_seconds": round(extract_s, 4),
+                    "encode_seconds": round(encode_s, 4),
+                    "copy_seconds": round(copy_s, 4),
+                    "bytes": sum(len(p) for p in payloads.values()),
+                }
+                print(
+                    f"{name:>14}: extract {extract_s:.3f}s  encode {encode_s:.3f}s  "
+                    f"COPY {copy_s:.3f}s  ({results[name]['bytes'] / 2**20:.1f} MB)"
+                )
+    finally:
+        use_timestamp_format("raw")
+
+    if args.output:
+        report = {
+            "benchmark": "timestamps",
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "config": {k: getattr(args, k) for k in ("tweets", "seed", "tables", "repeat")},
+            "results": results,
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, indent=2)
+        print(f"Results written to {args.output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for import_data.py")
+    sub = parser.add_subparsers(dest="bench", required=True)
+
+    p = sub.add_parser("copy-format", help="CSV vs binary COPY encoding (and loading with --db)")
+    p.add_argument("--input", required=True, help="jsonl or jsonl.gz file to take tweets from")
+    p.add_argument("--limit", type=int, default=50_000, help="Number of input lines to use")
+    p.add_argument("--repeat", type=int, default=3, help="Encoding runs per format; the best is reported")
+    p.add_argument("--db", action="store_true", help="Also time COPY into temp tables on the configured database")
+    p.set_defaults(func=bench_copy_format)
+
+    p = sub.add_parser("parse", help="Parsing side stages on synthetic tweets")
+    p.add_argument("--tweets", type=int, default=20_000, help="Number of top-level tweets to generate")
+    p.add_argument("--seed", type=int, default=1, help="Generator seed")
+    p.add_argument("--repeat", type=int, default=3, help="Runs per stage; the best is reported")
+    p.add_argument("--retweet-ratio", type=float, default=0.4, help="Share of tweets that are retweets")
+    p.add_argument("--quote-ratio", type=float, default=0.1, help="Share of the other tweets that quote a tweet")
+    p.add_argument("--hashtags", type=float, default=1.5, help="Mean number of hashtags per tweet")
+    p.add_argument("--media-ratio", type=float, default=0.2, help="Share of tweets with media")
+    p.add_argument("--long-text-ratio", type=float, default=0.3, help="Share of tweets with long text")
+    p.add_argument("--allocations", action="store_true", help="Also measure the memory allocated per tweet (tracemalloc)")
+    p.add_argument("--output", help="Write the results as JSON to this file")
+    p.add_argument("--compare", help="Earlier JSON results to print the change against")
+    p.set_defaults(func=bench_parse)
+
+    p = sub.add_parser("tmp-index", help="COPY and merge time of each --tmp-index strategy per table (needs the database)")
+    p.add_argument("--input", help="jsonl or jsonl.gz file to take tweets from instead of synthetic ones")
+    p.add_argument("--tweets", type=int, default=20_000, help="Number of tweets (input lines) to use")
+    p.add_argument("--seed", type=int, default=1, help="Generator seed")
+    p.add_argument("--preload", type=float, default=0.5, help="Share of the rows already in the target, so the merge meets conflicts")
+    p.add_argument("--merge-mode", choices=("first", "latest"), default="first", help="Merge SQL to time")
+    p.add_argument(
+        "--partitions",
+        type=int,
+        default=1,
+        help="Time the partitioned tables through a staging table of this many partitions (--merge-partitions)",
+    )
+    p.add_argument("--tables", help="Comma separated tables (default: all)")
+    p.add_argument("--strategies", help="Comma separated strategies (default: all)")
+    p.add_argument("--repeat", type=int, default=3, help="Runs per strategy; the best is reported")
+    p.add_argument("--output", help="Write the results as JSON to this file")
+    p.set_defaults(func=bench_tmp_index)
+
+    p = sub.add_parser("gz-read", help="MB/s of the old text read path vs the bytes path with each available gz reader")
+    p.add_argument("--input", nargs="+", help=".jsonl.gz files to read instead of synthetic tweets")
+    p.add_argument("--tweets", type=int, default=50_000, help="Number of synthetic tweets without --input")
+    p.add_argument("--seed", type=int, default=1, help="Generator seed")
+    p.add_argument("--loads", action="store_true", help="Include orjson.loads of every line")
+    p.add_argument("--repeat", type=int, default=3, help="Runs per reader; the best is reported")
+    p.add_argument("--output", help="Write the results as JSON to this file")
+    p.set_defaults(func=bench_gz_read)
+
+    p = sub.add_parser(
+        "row-builders",
+        help="extract_from_tweet with the generated row builders vs the hand-written version before them "
+        "(rows checked equal), and each builder vs walking ROW_SPECS per row",
+    )
+    p.add_argument("--input", help="jsonl or jsonl.gz file to take tweets from instead of synthetic ones")
+    p.add_argument("--tweets", type=int, default=20_000, help="Number of tweets to generate or read")
+    p.add_argument("--seed", type=int, default=1, help="Generator seed")
+    p.add_argument("--repeat", type=int, default=3, help="Runs per builder; the best is reported")
+    p.add_argument("--output", help="Write the results as JSON to this file")
+    p.set_defaults(func=bench_row_builders)
+
+    p = sub.add_parser("timestamps", help="Worker and server COPY time of raw, ISO and epoch timestamps (needs the database)")
+    p.add_argument("--tweets", type=int, default=50_000, help="Number of top-level tweets to generate")
+    p.add_argument("--seed", type=int, default=1, help="Generator seed")
+    p.add_argument("--tables", default="users,tweets", help="Comma separated tables to COPY")
+    p.add_argument("--repeat", type=int, default=3, help="COPY runs per format; the best is reported")
+    p.add_argument("--output", help="Write the results as JSON to this file")
+    p.set_defaults(func=bench_timestamps)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,56 @@
 import argparse
+import cProfile
 import csv
 import gc
 import gzip
 import hashlib
 import json
 import math
+import io
+import itertools
+import multiprocessing
 import os
+import platform
+import pstats
+import queue
+import shutil
+import struct
+import subprocess
 import sys
 import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from functools import lru_cache, partial
 from pathlib import Path
-from typing import Dict, Any, Optional, Tuple, List
+from typing import Callable, Dict, Any, Iterator, NamedTuple, Optional, Tuple, List
 import time
 import orjson
 
 import psycopg2
+from psycopg2 import errorcodes
+from psycopg2.pool import ThreadedConnectionPool
 from dotenv import load_dotenv
 
+try:  # optional: ISA-L gzip, several times faster than zlib
+    from isal import igzip
+except ImportError:
+    igzip = None
+try:  # optional: zlib-ng gzip
+    from zlib_ng import gzip_ng
+except ImportError:
+    gzip_ng = None
+try:  # optional: --sink parquet
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+from import_schema import defer_constraints, restore_constraints
+from integrity_report import integrity_report, print_report, write_report_json
+
 load_dotenv()
 
 
@@ -31,20 +65,114 @@ DB_DSN = f"dbname={DBNAME} user={DBUSER} password={DBPASS} host={DBHOST} port={D
 
 # ---------- Configuration ----------
 CSV_QUOTECHAR = '"'
-CSV_ESCAPECHAR = "\\"
+# Postgres CSV only honours ESCAPE inside quoted fields, so a backslash escape
+# mangled quotes and backslashes; quote doubling round-trips both.
+CSV_ESCAPECHAR = '"'
 CSV_DELIMITER = "\t"
 BAD_LINES_LOG = "bad_lines.log"
+DEADLOCK_RETRIES = 5
+
+# Rows produced by extract_from_tweet, per table: (column, source, coercion,
+# Postgres type) in row order. The source is a path into the JSON record the
+# row is built from ("extended_tweet.full_text", "display_text_range.0"),
+# "|" separating alternatives of which the first truthy one is taken, or
+# "@name" for a value the extractor computes (the tweet id, the hashtag id).
+# Coercions:
+#   raw   the value as it is
+#   text  sanitize_text (None -> "")
+#   int   int(), None stays None
+#   id    int() of a truthy value, anything else -> None
+#   timestamp  a created_at in the --timestamps format (TIMESTAMP_COERCIONS)
+# compile_row_builders turns every table into a generated function; COPY
+# names the columns, so the order need not follow database_schema.sql.
+ROW_SPECS = {
+    "users": (
+        ("id", "id|id_str", "id", "int8"),
+        ("screen_name", "screen_name", "text", "text"),
+        ("name", "name", "text", "text"),
+        ("description", "description", "text", "text"),
+        ("verified", "verified", "raw", "bool"),
+        ("protected", "protected", "raw", "bool"),
+        ("followers_count", "followers_count", "raw", "int4"),
+        ("friends_count", "friends_count", "raw", "int4"),
+        ("statuses_count", "statuses_count", "raw", "int4"),
+        ("created_at", "created_at", "timestamp", "timestamp"),
+        ("location", "location", "text", "text"),
+        ("url", "url", "text", "text"),
+        ("snapshot_at", "@snapshot_at", "timestamp", "timestamp"),
+    ),
+    "places": (
+        ("id", "id", "text", "text"),
+        ("full_name", "full_name", "text", "text"),
+        ("country", "country", "text", "text"),
+        ("country_code", "country_code", "text", "text"),
+        ("place_type", "place_type", "text", "text"),
+    ),
+    "tweets": (
+        ("id", "@tid", "raw", "int8"),
+        ("created_at", "created_at", "timestamp", "timestamp"),
+        ("full_text", "full_text|extended_tweet.full_text|text", "text", "text"),
+        ("display_from", "display_text_range.0", "int", "int4"),
+        ("display_to", "display_text_range.1", "int", "int4"),
+        ("lang", "lang", "text", "text"),
+        ("user_id", "user.id|user.id_str", "id", "int8"),
+        ("source", "source", "text", "text"),
+        ("in_reply_to_status_id", "in_reply_to_status_id", "id", "int8"),
+        ("quoted_status_id", "quoted_status_id", "id", "int8"),
+        ("retweeted_status_id", "retweeted_status.id", "id", "int8"),
+        ("place_id", "place.id", "text", "text"),
+        ("retweet_count", "retweet_count", "raw", "int4"),
+        ("favorite_count", "favorite_count", "raw", "int4"),
+        ("possibly_sensitive", "possibly_sensitive", "raw", "bool"),
+    ),
+    "hashtags": (
+        ("id", "@hid", "raw", "int8"),
+        ("tag", "@tag", "text", "text"),
+    ),
+    "tweet_hashtag": (
+        ("tweet_id", "@tid", "raw", "int8"),
+        ("hashtag_id", "@hid", "raw", "int8"),
+    ),
+    "tweet_urls": (
+        ("tweet_id", "@tid", "raw", "int8"),
+        ("url", "url", "text", "text"),
+        ("expanded_url", "expanded_url", "text", "text"),
+        ("display_url", "display_url", "text", "text"),
+        ("unwound_url", "unwound_url|expanded_url", "text", "text"),
+    ),
+    "tweet_user_mentions": (
+        ("tweet_id", "@tid", "raw", "int8"),
+        ("mentioned_user_id", "id|id_str", "id", "int8"),
+        ("mentioned_screen_name", "screen_name", "text", "text"),
+        ("mentioned_name", "name", "text", "text"),
+    ),
+    "tweet_media": (
+        ("tweet_id", "@tid", "raw", "int8"),
+        ("media_id", "id|id_str", "id", "int8"),
+        ("type", "type", "text", "text"),
+        ("media_url", "media_url", "text", "text"),
+        ("media_url_https", "media_url_https", "text", "text"),
+        ("display_url", "display_url", "text", "text"),
+        ("expanded_url", "expanded_url", "text", "text"),
+    ),
+}
+
+# Column order of the rows produced by extract_from_tweet
+TABLE_COLUMNS = {t: tuple(c[0] for c in spec) for t, spec in ROW_SPECS.items()}
+
+TABLE_COLS = {t: len(cols) for t, cols in TABLE_COLUMNS.items()}
 
-TABLE_COLS = {
-    "users": 12,
-    "places": 5,
-    "tweets": 16,
-    "hashtags": 2,
-    "tweet_hashtag": 2,
-    "tweet_urls": 5,
-    "tweet_user_mentions": 4,
-    "tweet_media": 7,
+# Postgres types of TABLE_COLUMNS, used by the binary COPY and Parquet writers
+COLUMN_TYPES = {t: tuple(c[3] for c in spec) for t, spec in ROW_SPECS.items()}
+
+MONTHS = {
+    m: i
+    for i, m in enumerate(
+        ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"),
+        start=1,
+    )
 }
+MONTH_DIGITS = {m: f"{i:02d}" for m, i in MONTHS.items()}
 
 
 # ---------- Utilities ----------
@@ -52,6 +180,8 @@ def sanitize_text(v: Optional[Any]) -> Optional[str]:
     """Converting provided value to string and removing undesired null characters."""
     if v is None:
         return ""
+    if v.__class__ is str:
+        return v.replace("\x00", "")
     if isinstance(v, (dict, list)):
         s = json.dumps(v, ensure_ascii=False)
     else:
@@ -62,163 +192,424 @@ def sanitize_text(v: Optional[Any]) -> Optional[str]:
     return s
 
 
-def hashtag_id_from_tag(tag: str) -> int:
-    return int(hashlib.sha256(tag.encode("utf-8")).hexdigest(), 16) % (2**63)
+@lru_cache(maxsize=65536)
+def twitter_ts_sort_key(value: Optional[str]) -> str:
+    """
+    Sortable key of a Twitter created_at ("Wed Mar 11 10:00:00 +0000 2020",
+    always UTC). Values in any other format are returned unchanged.
+    """
+    if not value:
+        return ""
+    if len(value) == 30 and value[4:7] in MONTHS:
+        return f"{value[26:30]}{MONTHS[value[4:7]]:02d}{value[8:10]} {value[11:19]}"
+    return value
+
+
+@lru_cache(maxsize=65536)
+def twitter_ts_to_iso(value: Optional[str]) -> Optional[str]:
+    """
+    ISO 8601 form ("2020-03-11 10:00:00") of a Twitter created_at, which is
+    cheaper for Postgres to parse during COPY. The offset is always +0000 and a TIMESTAMP
+    column drops it anyway. Values in any other format are returned unchanged.
+    """
+    if value and len(value) == 30:
+        month = MONTH_DIGITS.get(value[4:7])
+        if month:
+            return f"{value[26:30]}-{month}-{value[8:10]} {value[11:19]}"
+    return value
+
+
+# ---------- Binary COPY format ----------
+BINARY_COPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+BINARY_COPY_TRAILER = struct.pack(">h", -1)
+PG_EPOCH = datetime(2000, 1, 1)
+
+_FIELD_LEN = struct.Struct(">i")
+_INT8_FIELD = struct.Struct(">iq")
+_INT4_FIELD = struct.Struct(">ii")
+_NULL_FIELD = _FIELD_LEN.pack(-1)
+_TRUE_FIELD = _FIELD_LEN.pack(1) + b"\x01"
+_FALSE_FIELD = _FIELD_LEN.pack(1) + b"\x00"
+
+
+@lru_cache(maxsize=4096)
+def _pg_day_micros(year: int, month: int, day: int) -> int:
+    return (datetime(year, month, day) - PG_EPOCH) // timedelta(microseconds=1)
+
+
+@lru_cache(maxsize=65536)
+def timestamp_to_pg_micros(value: str) -> int:
+    """
+    Microseconds since 2000-01-01 of a Twitter created_at (or ISO) value. Like
+    Postgres parsing it into a TIMESTAMP column, the UTC offset is dropped.
+    """
+    month = MONTHS.get(value[4:7]) if len(value) == 30 else None
+    if month:
+        seconds = int(value[11:13]) * 3600 + int(value[14:16]) * 60 + int(value[17:19])
+        return _pg_day_micros(int(value[26:30]), month, int(value[8:10])) + seconds * 1_000_000
+    dt = datetime.fromisoformat(value)
+    return (dt.replace(tzinfo=None) - PG_EPOCH) // timedelta(microseconds=1)
+
+
+def _encode_text(v) -> bytes:
+    b = (v if isinstance(v, str) else str(v)).encode("utf-8")
+    return _FIELD_LEN.pack(len(b)) + b
+
+
+BINARY_ENCODERS = {
+    "int8": lambda v: _INT8_FIELD.pack(8, int(v)),
+    "int4": lambda v: _INT4_FIELD.pack(4, int(v)),
+    "bool": lambda v: _TRUE_FIELD if v else _FALSE_FIELD,
+    "text": _encode_text,
+    # --timestamps epoch rows already hold the microseconds
+    "timestamp": lambda v: _INT8_FIELD.pack(8, v if v.__class__ is int else timestamp_to_pg_micros(v)),
+}
+
+
+class BinaryCopyWriter:
+    """
+    csv.writer look-alike producing PostgreSQL binary COPY tuples for one
+    table, typed by COLUMN_TYPES. Like the CSV output, None and "" are NULL.
+
+    With framed=True the file header is written before the first row and
+    finish() writes the trailer, giving a complete COPY file. Unframed output
+    is bare tuples that can be concatenated into a longer COPY stream.
+    """
+
+    def __init__(self, f, table_name: str, framed: bool = True):
+        self.f = f
+        self.encoders = [BINARY_ENCODERS[t] for t in COLUMN_TYPES[table_name]]
+        self.field_count = struct.pack(">h", len(self.encoders))
+        self.framed = framed
+        self.started = False
+
+    def writerows(self, rows):
+        out = bytearray()
+        if self.framed and not self.started:
+            out += BINARY_COPY_HEADER
+        self.started = True
+        field_count = self.field_count
+        for row in rows:
+            out += field_count
+            for encode, v in zip(self.encoders, row):
+                out += _NULL_FIELD if v is None or v == "" else encode(v)
+        self.f.write(out)
+
+    def finish(self):
+        if self.framed and self.started:
+            self.f.write(BINARY_COPY_TRAILER)
+
+
+# ---------- Parquet sink ----------
+PARQUET_ROW_GROUP_ROWS = 128 * 1024
+# Microseconds from 1970-01-01 to PG_EPOCH
+_UNIX_TO_PG_MICROS = (PG_EPOCH - datetime(1970, 1, 1)) // timedelta(microseconds=1)
+
+# Arrow types of the COLUMN_TYPES; timestamps are stored like Postgres does,
+# without time zone
+ARROW_TYPES = {
+    "int8": lambda: pa.int64(),
+    "int4": lambda: pa.int32(),
+    "bool": lambda: pa.bool_(),
+    "text": lambda: pa.string(),
+    "timestamp": lambda: pa.timestamp("us"),
+}
+
+PARQUET_CONVERTERS = {
+    "int8": int,
+    "int4": int,
+    "bool": bool,
+    "text": lambda v: v if isinstance(v, str) else str(v),
+    "timestamp": lambda v: (v if v.__class__ is int else timestamp_to_pg_micros(v)) + _UNIX_TO_PG_MICROS,
+}
+
+
+def arrow_schema(table_name: str):
+    return pa.schema(
+        [
+            (col, ARROW_TYPES[typ]())
+            for col, typ in zip(TABLE_COLUMNS[table_name], COLUMN_TYPES[table_name])
+        ]
+    )
+
+
+class ParquetTableWriter:
+    """
+    csv.writer look-alike writing the rows of one table as a Parquet file,
+    typed by COLUMN_TYPES. Rows are buffered and written as row groups of
+    PARQUET_ROW_GROUP_ROWS rows (with min/max statistics); finish() writes
+    the rest and the footer. Like the CSV output, None and "" are NULL.
+    """
+
+    def __init__(self, f, table_name: str, compression: str = "zstd"):
+        self.f = f
+        self.types = COLUMN_TYPES[table_name]
+        self.schema = arrow_schema(table_name)
+        self.compression = compression
+        self.writer = None
+        self.rows = []
+
+    def writerows(self, rows):
+        self.rows.extend(rows)
+        if len(self.rows) >= PARQUET_ROW_GROUP_ROWS:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered rows as a (possibly short) row group."""
+        if not self.rows:
+            return
+        columns = []
+        for typ, values in zip(self.types, zip(*self.rows)):
+            convert = PARQUET_CONVERTERS[typ]
+            columns.append(
+                pa.array([None if v is None or v == "" else convert(v) for v in values], type=ARROW_TYPES[typ]())
+            )
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.f, self.schema, compression=self.compression)
+        self.writer.write_table(pa.Table.from_arrays(columns, schema=self.schema))
+        self.rows = []
+
+    def finish(self):
+        self.flush()
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+# Hashtag ids are derived from the tag so every worker agrees without a lookup.
+# Version 1 is the original SHA-256 scheme, version 2 takes the 8 byte BLAKE2b
+# digest directly. Both are stable 63-bit ids, but they differ, so one
+# database must only ever be loaded with one version.
+HASHTAG_ID_MASK = 2**63 - 1
+
+
+def _hashtag_id_v1(data: bytes) -> int:
+    # same value as int(sha256.hexdigest(), 16) % 2**63 without the hex detour
+    return int.from_bytes(hashlib.sha256(data).digest(), "big") & HASHTAG_ID_MASK
+
+
+def _hashtag_id_v2(data: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "big") & HASHTAG_ID_MASK
+
+
+HASHTAG_ID_VERSIONS = {1: _hashtag_id_v1, 2: _hashtag_id_v2}
+
+
+@lru_cache(maxsize=65536)
+def _hashtag_id(tag: str, version: int) -> int:
+    return HASHTAG_ID_VERSIONS[version](tag.encode("utf-8"))
+
+
+def hashtag_id_from_tag(tag: str, version: Optional[int] = None) -> int:
+    """Id of tag, by default in the --hashtag-id-version of the run."""
+    if version is None:
+        version = WORKER_OPTIONS["hashtag_id_version"]
+    return _hashtag_id(tag, version)
+
+
+# ---------- Row builders generated from ROW_SPECS ----------
+ROW_COERCIONS = {
+    "raw": "{v}",
+    "text": '({v}.replace("\\x00", "") if {v}.__class__ is str else "" if {v} is None else _sanitize_text({v}))',
+    "int": "(None if {v} is None else int({v}))",
+    "id": "(int({v}) if {v} else None)",
+}
+
+# The "timestamp" coercion per --timestamps format of the created_at values:
+#   raw    the Twitter string ("Wed Mar 11 10:00:00 +0000 2020"), parsed by Postgres
+#   iso    "2020-03-11 10:00:00"
+#   epoch  microseconds since 2000-01-01 (int), for binary COPY and Parquet
+# Conversions are memoized: the tweets of a file share few distinct seconds.
+TIMESTAMP_FORMATS = ("raw", "iso", "epoch")
+TIMESTAMP_COERCIONS = {
+    "raw": "{v}",
+    "iso": "_twitter_ts_to_iso({v})",
+    "epoch": "(_timestamp_to_pg_micros({v}) if {v} else None)",
+}
+
+# Sortable form of the timestamps of each format, empty values lowest
+TIMESTAMP_SORT_KEYS = {
+    "raw": twitter_ts_sort_key,
+    "iso": lambda v: v or "",
+    "epoch": lambda v: float("-inf") if v is None else v,
+}
+
+
+def _lookup(node: str, key: str) -> str:
+    """Expression for key of the JSON value in local node, None if it has none."""
+    if key.isdigit():
+        return f"({node}[{key}] if {node}.__class__ is list and len({node}) > {key} else None)"
+    if node == "r":
+        return f'r.get("{key}")'
+    return f'({node}.get("{key}") if {node}.__class__ is dict else None)'
+
+
+def row_builder_source(table_name: str, timestamps: str = "raw") -> str:
+    """
+    Source of the row builder of table_name: a function taking the record r
+    (if any column has a path source) and then the "@" values in order of
+    first use, returning the row tuple. Intermediate objects of the paths
+    ("user" of "user.id") are looked up once into locals, other values only
+    when their coercion uses them twice: the rest are written into the tuple
+    directly, which is what keeps the builders as fast as hand-written
+    tuples. Timestamp columns are converted to the timestamps format.
+    """
+    coercions = dict(ROW_COERCIONS, timestamp=TIMESTAMP_COERCIONS[timestamps])
+    spec = ROW_SPECS[table_name]
+    params = list(dict.fromkeys(src[1:] for _, src, _, _ in spec if src.startswith("@")))
+    uses_record = any(not src.startswith("@") for _, src, _, _ in spec)
+    body = []
+    nodes = {(): "r"}
+
+    def node(prefix: tuple) -> str:
+        if prefix not in nodes:
+            parent = node(prefix[:-1])
+            nodes[prefix] = f"n{len(nodes)}"
+            body.append(f"    {nodes[prefix]} = {_lookup(parent, prefix[-1])}")
+        return nodes[prefix]
+
+    values = []
+    for i, (_, src, coercion, _) in enumerate(spec):
+        if src.startswith("@"):
+            expr = src[1:]
+        else:
+            alternatives = []
+            for alt in src.split("|"):
+                keys = tuple(alt.split("."))
+                alternatives.append(_lookup(node(keys[:-1]), keys[-1]))
+            expr = " or ".join(alternatives)
+        template = coercions[coercion]
+        if src.startswith("@") or template.count("{v}") == 1:
+            values.append(template.format(v=f"({expr})" if " or " in expr else expr))
+        else:
+            body.append(f"    v{i} = {expr}")
+            values.append(template.format(v=f"v{i}"))
+
+    head = f"def build_{table_name}({', '.join(['r'] * uses_record + params)}):"
+    return "\n".join([head] + body + [f"    return ({', '.join(values)},)"]) + "\n"
+
+
+def compile_row_builders(timestamps: str = "raw") -> Dict[str, Callable[..., Tuple]]:
+    """One generated, compiled row builder per table of ROW_SPECS."""
+    builders = {}
+    for t in ROW_SPECS:
+        namespace = {
+            "_sanitize_text": sanitize_text,
+            "_twitter_ts_to_iso": twitter_ts_to_iso,
+            "_timestamp_to_pg_micros": timestamp_to_pg_micros,
+        }
+        exec(compile(row_builder_source(t, timestamps), f"<row builder {t}>", "exec"), namespace)
+        builders[t] = namespace[f"build_{t}"]
+    return builders
+
+
+ROW_BUILDERS = compile_row_builders()
+_build_user = ROW_BUILDERS["users"]
+
+
+def use_timestamp_format(timestamps: str) -> None:
+    """Recompile ROW_BUILDERS so extract_from_tweet emits timestamps in this format."""
+    global _build_user
+    ROW_BUILDERS.update(compile_row_builders(timestamps))
+    _build_user = ROW_BUILDERS["users"]
 
 
-def extract_from_tweet(tweet: Dict[str, Any]) -> Dict[str, List[Tuple]]:
+def _collect_user_rows(tweet: Dict[str, Any], snapshot_at: Optional[str], out: List[Tuple]):
+    """Append the users rows of tweet and of the tweets embedded in it to out."""
+    user = tweet.get("user")
+    if user:
+        out.append(_build_user(user, snapshot_at))
+    for key in ("retweeted_status", "quoted_status"):
+        sub = tweet.get(key)
+        if sub and isinstance(sub, dict):
+            _collect_user_rows(sub, snapshot_at, out)
+
+
+def extract_from_tweet(
+    tweet: Dict[str, Any],
+    snapshot_at: Optional[str] = None,
+    seen=None,
+    rows: Optional[Dict[str, List[Tuple]]] = None,
+) -> Dict[str, List[Tuple]]:
     """
     Extract rows for staging tables from a tweet dict.
     Also recursively extracts retweeted_status and quoted_status.
+
+    Rows are appended to the per-table lists of rows, a new dict when not
+    given; the worker passes its batch lists so nothing is copied per tweet.
+
+    snapshot_at is the created_at of the outermost tweet: embedded tweets and
+    their users were captured together with it, so users rows carry it as the
+    time of their profile snapshot.
+
+    seen is an optional DedupCache of tweet ids: a tweet already extracted is
+    skipped together with everything embedded in it. In "latest" merge mode
+    a copy with higher counters is extracted again.
     """
-    rows = {
-        "users": [],
-        "places": [],
-        "tweets": [],
-        "hashtags": [],
-        "tweet_hashtag": [],
-        "tweet_urls": [],
-        "tweet_user_mentions": [],
-        "tweet_media": [],
-    }
+    if rows is None:
+        rows = {t: [] for t in TABLE_COLUMNS}
 
     tid = tweet.get("id") or tweet.get("id_str")
     if tid is None:
         return rows
     tid = int(tid)
+    if snapshot_at is None:
+        snapshot_at = tweet.get("created_at")
+    if seen is not None:
+        latest = WORKER_OPTIONS["merge_mode"] == "latest"
+        version = None
+        if latest:
+            # counters only grow, so their sum tells a newer copy
+            version = (tweet.get("retweet_count") or 0) + (tweet.get("favorite_count") or 0)
+        if seen.seen(tid, version):
+            if latest:
+                # the profiles still are snapshots newer than the stored ones
+                _collect_user_rows(tweet, snapshot_at, rows["users"])
+            return rows
+
+    build = ROW_BUILDERS
 
-    # ---------------- USERS ----------------
     user = tweet.get("user")
     if user:
-        rows["users"].append(
-            (
-                int(user.get("id") or user.get("id_str") or 0),
-                sanitize_text(user.get("screen_name")),
-                sanitize_text(user.get("name")),
-                sanitize_text(user.get("description")),
-                user.get("verified"),
-                user.get("protected"),
-                user.get("followers_count"),
-                user.get("friends_count"),
-                user.get("statuses_count"),
-                user.get("created_at"),
-                sanitize_text(user.get("location")),
-                sanitize_text(user.get("url")),
-            )
-        )
+        rows["users"].append(_build_user(user, snapshot_at))
 
-    # ---------------- PLACES ----------------
     place = tweet.get("place")
     if place:
-        rows["places"].append(
-            (
-                sanitize_text(place.get("id")),
-                sanitize_text(place.get("full_name")),
-                sanitize_text(place.get("country")),
-                sanitize_text(place.get("country_code")),
-                sanitize_text(place.get("place_type")),
-            )
-        )
+        rows["places"].append(build["places"](place))
 
-    # ---------------- TWEETS ----------------
-    def get_full_text(t: dict):
-        if t.get("full_text"):
-            return t["full_text"]
-        ext = t.get("extended_tweet") or {}
-        if ext.get("full_text"):
-            return ext["full_text"]
-
-        return t.get("text") or ""
-
-    display_from, display_to = None, None
-    dtr = tweet.get("display_text_range")
-    if isinstance(dtr, (list, tuple)) and len(dtr) >= 2:
-        display_from, display_to = int(dtr[0]), int(dtr[1])
-
-    tweet_row = (
-        tid,
-        tweet.get("created_at"),
-        sanitize_text(get_full_text(tweet)),
-        display_from,
-        display_to,
-        sanitize_text(tweet.get("lang")),
-        int(user.get("id") or user.get("id_str")) if user else None,
-        sanitize_text(tweet.get("source")),
-        (
-            int(tweet.get("in_reply_to_status_id"))
-            if tweet.get("in_reply_to_status_id")
-            else None
-        ),
-        int(tweet.get("quoted_status_id")) if tweet.get("quoted_status_id") else None,
-        (
-            int(tweet.get("retweeted_status", {}).get("id"))
-            if tweet.get("retweeted_status", {}).get("id")
-            else None
-        ),
-        sanitize_text(place.get("id") if place else None),
-        tweet.get("retweet_count"),
-        tweet.get("favorite_count"),
-        tweet.get("possibly_sensitive"),
-    )
-    rows["tweets"].append(tweet_row)
+    rows["tweets"].append(build["tweets"](tweet, tid))
 
-    # ---------------- ENTITIES ----------------
     entities = tweet.get("entities") or {}
-    # hashtags
+    hashtag_rows, tweet_hashtag_rows = rows["hashtags"], rows["tweet_hashtag"]
+    build_hashtag, build_tweet_hashtag = build["hashtags"], build["tweet_hashtag"]
     for h in entities.get("hashtags", []):
         tag_text = h.get("text") or h.get("tag")
         if not tag_text:
             continue
         tag_norm = tag_text.strip()
         hid = hashtag_id_from_tag(tag_norm)
-        rows["hashtags"].append((hid, sanitize_text(tag_norm)))
-        rows["tweet_hashtag"].append((tid, hid))
+        hashtag_rows.append(build_hashtag(hid, tag_norm))
+        tweet_hashtag_rows.append(build_tweet_hashtag(tid, hid))
 
-    # urls
+    out, build_url = rows["tweet_urls"], build["tweet_urls"]
     for u in entities.get("urls", []):
-        rows["tweet_urls"].append(
-            (
-                tid,
-                sanitize_text(u.get("url")),
-                sanitize_text(u.get("expanded_url")),
-                sanitize_text(u.get("display_url")),
-                sanitize_text(u.get("unwound_url") or u.get("expanded_url")),
-            )
-        )
+        out.append(build_url(u, tid))
 
-    # user_mentions
+    out, build_mention = rows["tweet_user_mentions"], build["tweet_user_mentions"]
     for m in entities.get("user_mentions", []):
-        mid = m.get("id") or m.get("id_str")
-        if not mid:
-            continue
-        rows["tweet_user_mentions"].append(
-            (
-                tid,
-                int(mid),
-                sanitize_text(m.get("screen_name")),
-                sanitize_text(m.get("name")),
-            )
-        )
+        row = build_mention(m, tid)
+        # mentions without a user id have nothing to reference
+        if row[1] is not None:
+            out.append(row)
 
-    # media
     media_block = (
         (tweet.get("extended_entities") or {}).get("media")
         or entities.get("media")
         or []
     )
-
+    out, build_media = rows["tweet_media"], build["tweet_media"]
     for mm in media_block:
-        rows["tweet_media"].append(
-            (
-                tid,
-                int(mm.get("id") or mm.get("id_str")) or None,
-                sanitize_text(mm.get("type")),
-                sanitize_text(mm.get("media_url")),
-                sanitize_text(mm.get("media_url_https")),
-                sanitize_text(mm.get("display_url")),
-                sanitize_text(mm.get("expanded_url")),
-            )
-        )
+        out.append(build_media(mm, tid))
 
     # ---------------- RECURSIVE extraction ----------------
 
@@ -227,380 +618,2387 @@ def extract_from_tweet(tweet: Dict[str, Any]) -> Dict[str, List[Tuple]]:
 
         if sub and isinstance(sub, dict) and (sub.get("id") or sub.get("id_str")):
 
-            sub_rows = extract_from_tweet(sub)
-            for k, v in sub_rows.items():
-                rows[k].extend(v)
+            extract_from_tweet(sub, snapshot_at, seen, rows)
 
     return rows
 
 
+# ---------- inputs: files and shards ----------
+class Shard(NamedTuple):
+    """Newline-aligned byte range [start, end) of an uncompressed input file."""
+
+    path: str
+    start: int
+    end: int
+
+
+def describe_unit(unit) -> str:
+    if isinstance(unit, Shard):
+        return f"{unit.path}[{unit.start}:{unit.end}]"
+    return str(unit)
+
+
+def estimate_input_size(path: str) -> int:
+    """
+    Size of an input file. For .gz files the ISIZE trailer is used when it is
+    larger than the file itself; it only holds the uncompressed size of the
+    last member modulo 2**32, so this is an estimate for scheduling.
+    """
+    size = os.path.getsize(path)
+    if not path.endswith(".gz") or size < 4:
+        return size
+    with open(path, "rb") as fh:
+        fh.seek(-4, os.SEEK_END)
+        return max(size, int.from_bytes(fh.read(4), "little"))
+
+
+def unit_size(unit) -> int:
+    if isinstance(unit, Shard):
+        return unit.end - unit.start
+    return estimate_input_size(unit)
+
+
+def plan_shards(path: str, shard_bytes: int) -> list:
+    """Split an uncompressed file into shards of about shard_bytes on line boundaries."""
+    size = os.path.getsize(path)
+    if shard_bytes <= 0 or size <= shard_bytes:
+        return [path]
+
+    count = math.ceil(size / shard_bytes)
+    step = math.ceil(size / count)
+    bounds = [0]
+    with open(path, "rb") as fh:
+        for approx in range(step, size, step):
+            if approx <= bounds[-1]:
+                continue
+            fh.seek(approx)
+            # moving the cut right behind the next newline
+            fh.readline()
+            pos = fh.tell()
+            if pos >= size:
+                break
+            bounds.append(pos)
+    bounds.append(size)
+
+    return [Shard(path, start, end) for start, end in zip(bounds, bounds[1:])]
+
+
+# Bytes read from an input at once; lines are split out of these blocks
+READ_BLOCK_BYTES = 1024 * 1024
+
+# .gz decompressors for --gz-reader, fastest first; "auto" takes the first
+# one available. pigz runs as a separate process, so decompression and
+# parsing use two cores.
+GZ_READERS = ("isal", "zlib-ng", "pigz", "gzip")
+
+
+def gz_reader_available(name: str) -> bool:
+    if name == "isal":
+        return igzip is not None
+    if name == "zlib-ng":
+        return gzip_ng is not None
+    if name == "pigz":
+        return shutil.which("pigz") is not None
+    return name == "gzip"
+
+
+def resolve_gz_reader(name: str) -> str:
+    """The --gz-reader to use for name ("auto" or one of GZ_READERS)."""
+    if name == "auto":
+        return next(r for r in GZ_READERS if gz_reader_available(r))
+    if name not in GZ_READERS or not gz_reader_available(name):
+        raise ValueError(f"gz reader {name} is not available")
+    return name
+
+
+@contextmanager
+def open_input(path: str, gz_reader: Optional[str] = None):
+    """
+    Binary file object with the uncompressed content of an input file; .gz
+    files are decompressed with gz_reader (default: the worker's --gz-reader).
+    """
+    if not path.endswith(".gz"):
+        with open(path, "rb") as fh:
+            yield fh
+        return
+
+    gz_reader = resolve_gz_reader(gz_reader or WORKER_OPTIONS["gz_reader"])
+    if gz_reader != "pigz":
+        opener = {"isal": getattr(igzip, "open", None), "zlib-ng": getattr(gzip_ng, "open", None)}
+        with opener.get(gz_reader, gzip.open)(path, "rb") as fh:
+            yield fh
+        return
+
+    proc = subprocess.Popen(["pigz", "-dc", path], stdout=subprocess.PIPE, bufsize=READ_BLOCK_BYTES)
+    try:
+        yield proc.stdout
+    except BaseException:
+        proc.kill()
+        raise
+    finally:
+        proc.stdout.close()
+        returncode = proc.wait()
+    if returncode:
+        raise OSError(f"pigz -dc {path} exited with {returncode}")
+
+
+def decompress_gz(path: str, out_dir: str, gz_reader: str = "auto") -> str:
+    """Decompress a .gz input once into out_dir so that it can be sharded."""
+    out_path = Path(out_dir) / Path(path).name[: -len(".gz")]
+    with open_input(path, gz_reader) as src, open(out_path, "wb") as dst:
+        shutil.copyfileobj(src, dst, 16 * 1024 * 1024)
+    return str(out_path)
+
+
+def plan_work_units(args, files: List[str], tmp_root: Path, origins: Optional[dict] = None) -> list:
+    """
+    Turn the input files into work units ordered largest first. When given,
+    origins is filled with the input file every unit was planned from.
+
+    Uncompressed files above --shard-mb are split into Shards processed by
+    separate workers. gzip streams cannot be entered at an arbitrary offset, so
+    with --shard-gz large .gz files are decompressed once into the temp dir
+    (in parallel, one file per process) and then sharded like plain files.
+    """
+    shard_bytes = args.shard_mb * 1024 * 1024
+    decompressed = {}
+    to_decompress = [
+        f
+        for f in files
+        if args.shard_gz
+        and shard_bytes > 0
+        and f.endswith(".gz")
+        and estimate_input_size(f) > shard_bytes
+    ]
+    if to_decompress:
+        decompress_start = time.time()
+        out_dir = tmp_root / "decompressed"
+        out_dir.mkdir(parents=True, exist_ok=True)
+        with ProcessPoolExecutor(max_workers=args.workers) as ex:
+            outputs = ex.map(
+                decompress_gz,
+                to_decompress,
+                [str(out_dir)] * len(to_decompress),
+                [args.gz_reader] * len(to_decompress),
+            )
+            decompressed = dict(zip(to_decompress, outputs))
+        print(
+            f"Decompressed {len(to_decompress)} .gz files for sharding in {time.time() - decompress_start:.1f} seconds"
+        )
+
+    units = []
+    for f in files:
+        path = decompressed.get(f, f)
+        planned = [path] if path.endswith(".gz") else plan_shards(path, shard_bytes)
+        units.extend(planned)
+        if origins is not None:
+            origins.update((unit, f) for unit in planned)
+
+    units.sort(key=unit_size, reverse=True)
+    return units
+
+
+def _iter_block_lines(fh, limit: Optional[int] = None) -> Iterator[bytes]:
+    """
+    Lines of the binary file object fh without their newline, split out of
+    READ_BLOCK_BYTES reads; with a limit, only the next limit bytes are read.
+    """
+    tail = b""
+    remaining = limit
+    while remaining is None or remaining > 0:
+        block = fh.read(READ_BLOCK_BYTES if remaining is None else min(READ_BLOCK_BYTES, remaining))
+        if not block:
+            break
+        if remaining is not None:
+            remaining -= len(block)
+        lines = block.split(b"\n")
+        lines[0] = tail + lines[0]
+        tail = lines.pop()
+        yield from lines
+    if tail:
+        yield tail
+
+
+def iter_input_lines(source) -> Iterator[Tuple[int, bytes]]:
+    """
+    Yield (line number, line) of a whole input file or of one Shard. Lines are
+    undecoded bytes, orjson parses them as they are.
+    """
+    if isinstance(source, Shard):
+        with open(source.path, "rb") as fh:
+            fh.seek(source.start)
+            yield from enumerate(_iter_block_lines(fh, source.end - source.start), start=1)
+        return
+
+    with open_input(str(source)) as fh:
+        yield from enumerate(_iter_block_lines(fh), start=1)
+
+
 # ---------- worker: process one file ----------
-def process_file_worker(args: Tuple[str, int, str]) -> Dict[str, str]:
+# Set by _init_worker in the pool processes, None when called directly
+_OUTPUT_QUEUE = None
+
+# Worker settings, replaced by _init_worker with the values of the run
+WORKER_OPTIONS: Dict[str, Any] = {
+    "chunk_bytes": 0,
+    "stream": False,
+    "dedup_entries": 0,
+    "merge_mode": "first",
+    "copy_format": "csv",
+    "hashtag_id_version": 1,
+    "seen_tweets": 0,
+    "profile": False,
+    "run": 0,
+    "gz_reader": "auto",
+    "sink": "postgres",
+    "parquet_compression": "zstd",
+    "batch_size": 1000,
+    "memory_budget_mb": 0,
+    "timestamps": "raw",
+}
+
+# Sequence number of the runs of this process (one per --watch batch), it
+# keeps the per-run files of the workers, like their profiles, apart
+_RUN_SEQUENCE = itertools.count(1)
+
+
+def _init_worker(output_queue, options: Dict[str, Any]) -> None:
+    """Pool initializer handing the shared output queue and settings to every worker."""
+    global _OUTPUT_QUEUE
+    _OUTPUT_QUEUE = output_queue
+    WORKER_OPTIONS.update(options)
+    use_timestamp_format(WORKER_OPTIONS["timestamps"])
+
+
+def worker_options(args, stream: bool) -> Dict[str, Any]:
+    """WORKER_OPTIONS for a new run with the given command line args."""
+    if stream:
+        chunk_bytes = args.stream_chunk_kb * 1024
+    else:
+        chunk_bytes = args.chunk_mb * 1024 * 1024
+    return {
+        "chunk_bytes": chunk_bytes,
+        "stream": stream,
+        "dedup_entries": args.dedup_entries,
+        "merge_mode": args.merge_mode,
+        "copy_format": args.copy_format,
+        "timestamps": args.timestamps,
+        "hashtag_id_version": args.hashtag_id_version,
+        "seen_tweets": args.seen_tweets,
+        "profile": bool(args.profile),
+        "run": next(_RUN_SEQUENCE),
+        "gz_reader": args.gz_reader,
+        "sink": args.sink,
+        "parquet_compression": args.parquet_compression,
+        "batch_size": args.batch_size,
+        "memory_budget_mb": args.worker_memory_mb,
+    }
+
+
+class DedupCache:
+    """
+    Bounded LRU set of the keys a worker already emitted for one parent table.
+    Popular keys stay cached, the least recently seen one is evicted once
+    max_entries is reached.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.keys = OrderedDict()
+        self.suppressed = 0
+        self.evicted = 0
+
+    def seen(self, key, version=None) -> bool:
+        """
+        True if key was emitted before. With a version (a sortable snapshot
+        key), a newer version than the cached one counts as unseen.
+        """
+        keys = self.keys
+        if key in keys and (version is None or keys[key] >= version):
+            keys.move_to_end(key)
+            self.suppressed += 1
+            return True
+        keys[key] = version
+        keys.move_to_end(key)
+        if len(keys) > self.max_entries:
+            keys.popitem(last=False)
+            self.evicted += 1
+        return False
+
+    def clear(self):
+        self.keys.clear()
+
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def current_rss() -> int:
+    """Resident set size of this process in bytes (0 where /proc is missing)."""
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return 0
+
+
+class MemoryGovernor:
+    """
+    Keeps a worker under a resident memory budget. check() runs after every
+    batch flush: over the budget it collects a garbage generation (escalating
+    from 0 to 2 while the worker stays over) and halves the batch size down
+    to min_batch; well under the budget the batch size grows back. Without a
+    budget it only tracks the peak RSS.
+    """
+
+    def __init__(self, budget_bytes: int, batch_size: int, min_batch: int = 50):
+        self.budget = budget_bytes
+        self.max_batch = batch_size
+        self.min_batch = min(min_batch, batch_size)
+        self.batch_size = batch_size
+        self.smallest_batch = batch_size
+        self.peak = current_rss()
+        self.over_budget = 0
+        self.collections = [0, 0, 0]
+        self.generation = 0
+
+    def check(self) -> bool:
+        """Record the RSS and react to it; True if still over budget after collecting."""
+        rss = current_rss()
+        self.peak = max(self.peak, rss)
+        if not self.budget:
+            return False
+        if rss <= self.budget:
+            self.generation = 0
+            if rss < self.budget // 2 and self.batch_size < self.max_batch:
+                self.batch_size = min(self.max_batch, self.batch_size * 2)
+            return False
+
+        self.over_budget += 1
+        gc.collect(self.generation)
+        self.collections[self.generation] += 1
+        self.generation = min(self.generation + 1, 2)
+        self.batch_size = max(self.min_batch, self.batch_size // 2)
+        self.smallest_batch = min(self.smallest_batch, self.batch_size)
+        return current_rss() > self.budget
+
+
+def _make_table_writer(f, table_name: str, framed: bool = True):
+    if WORKER_OPTIONS["sink"] == "parquet":
+        return ParquetTableWriter(f, table_name, WORKER_OPTIONS["parquet_compression"])
+    if WORKER_OPTIONS["copy_format"] == "binary":
+        return BinaryCopyWriter(f, table_name, framed)
+    return csv.writer(
+        f,
+        delimiter=CSV_DELIMITER,
+        quotechar=CSV_QUOTECHAR,
+        escapechar=CSV_ESCAPECHAR,
+        quoting=csv.QUOTE_MINIMAL,
+        lineterminator="\n",
+    )
+
+
+def process_file_worker(args: Tuple[str, int, str]) -> Dict[str, Any]:
     """
-    Process one or more jsonl files and write TSV/CSV files for each staging table.
-    Returns dict mapping table -> path of file produced for this worker.
-    Generates per-worker-per-table files (one file per table per worker).
-    Uses batching for csv.writer to reduce Python overhead.
+    Process one or more jsonl inputs (files or shards of them) into the rows
+    of each staging table, written per table, worker and chunk in the format
+    of the sink: TSV/CSV or binary COPY files for Postgres (--copy-format),
+    Parquet files (--sink parquet), or encoded COPY data kept in memory in
+    --stream-copy mode. Rows are written in batches of --batch-size tweets.
+    Workers never connect to the database; for Postgres the parent loads
+    their output on MERGE_POOL connections, Parquet files are left for export.
+
+    When started through _init_worker the output is cut into chunks: whenever
+    the data written reaches the chunk size, the current per-table outputs are
+    handed to the parent through the bounded output queue as one frame
+    (table -> TSV path, or table -> encoded bytes in --stream-copy mode, where
+    nothing but the bad lines log touches the disk). Frames are only cut
+    between tweets, so the parent and child rows of a tweet always travel
+    together, and a full queue blocks the worker instead of growing memory.
+
+    Returns worker stats (lines, bad lines, rows and bytes written per table,
+    frames, seconds, seconds blocked on the queue); called directly, "outputs"
+    also lists the produced frames. With the profile option the work unit runs
+    under cProfile and "profile" names the dumped stats file, one per run and
+    worker id, so the profiles of earlier --watch batches are kept for the
+    final merge.
     """
+    try:
+        if not WORKER_OPTIONS["profile"]:
+            return _process_files(*args)
+        profiler = cProfile.Profile()
+        stats = profiler.runcall(_process_files, *args)
+        run = WORKER_OPTIONS["run"]
+        stats["profile"] = str(Path(args[2]) / f"profile__run{run}_worker{args[1]}.prof")
+        profiler.dump_stats(stats["profile"])
+        return stats
+    finally:
+        if _OUTPUT_QUEUE is not None:
+            # end marker, always sent so the parent can count finished workers
+            _OUTPUT_QUEUE.put((args[1], None))
+
+
+def _process_files(filepaths, worker_id: int, out_dir) -> Dict[str, Any]:
+    """Body of process_file_worker, see there."""
+    started = time.time()
+    memo_before = _hashtag_id.cache_info()
+    # no automatic collections while parsing; MemoryGovernor runs them when
+    # the worker crosses its memory budget, and objects that existed before
+    # this unit (modules, caches) are left out of those scans
     gc.disable()
-    filepaths, worker_id, out_dir = args
-    if isinstance(filepaths, str):
+    gc.freeze()
+    if isinstance(filepaths, (str, Shard)):
         filepaths = [filepaths]
     out_dir = Path(out_dir)
     out_dir.mkdir(parents=True, exist_ok=True)
+    out_q = _OUTPUT_QUEUE
+    stream = WORKER_OPTIONS["stream"] and out_q is not None
+    binary = WORKER_OPTIONS["copy_format"] == "binary"
+    parquet = WORKER_OPTIONS["sink"] == "parquet"
 
-    # Prepare per-table output files for this worker (single file per table per worker)
+    # Per-table outputs of the current chunk
     writers = {}
     files = {}
-    for t, _ in TABLE_COLS.items():
-        out_path = out_dir / f"{t}__worker{worker_id}.tsv"
-        f = open(out_path, "a", newline="", encoding="utf-8")
-        writer = csv.writer(
-            f,
-            delimiter=CSV_DELIMITER,
-            quotechar=CSV_QUOTECHAR,
-            escapechar=CSV_ESCAPECHAR,
-            quoting=csv.QUOTE_MINIMAL,
-            lineterminator="\n",
-        )
-        writers[t] = writer
-        files[t] = f
+    chunk_no = 0
+
+    def open_outputs():
+        for t, _ in TABLE_COLS.items():
+            if stream:
+                f = io.BytesIO() if binary else io.StringIO()
+            elif parquet:
+                f = open(out_dir / f"{t}__worker{worker_id}__chunk{chunk_no}.parquet", "wb")
+            elif binary:
+                f = open(out_dir / f"{t}__worker{worker_id}__chunk{chunk_no}.bin", "wb")
+            else:
+                out_path = out_dir / f"{t}__worker{worker_id}__chunk{chunk_no}.tsv"
+                f = open(out_path, "w", newline="", encoding="utf-8")
+            # streamed frames are parts of one COPY, the loader frames them
+            writers[t] = _make_table_writer(f, t, framed=not stream)
+            files[t] = f
+
+    open_outputs()
 
     bad_lines_path = out_dir / f"bad_lines__worker{worker_id}.log"
     bad_f = open(bad_lines_path, "a", encoding="utf-8")
 
-    # Batch buffers per table
-    batch_size = 1000
+    # Rows of the last batch_size tweets per table, filled by extract_from_tweet;
+    # the governor shrinks the batches when the worker runs out of memory
+    governor = MemoryGovernor(WORKER_OPTIONS["memory_budget_mb"] * 1024 * 1024, WORKER_OPTIONS["batch_size"])
     row_batches = {t: [] for t in TABLE_COLS.keys()}
+    stats = {"lines": 0, "bad_lines": 0, "frames": 0, "blocked": 0.0}
+    written = {t: 0 for t in TABLE_COLS}
+    written_bytes = {t: 0 for t in TABLE_COLS}
+    produced = []
+
+    # Parent rows (users, places, hashtags) already emitted by this worker. The
+    # chunks of one worker may be merged out of order, so in file mode a cache
+    # only spans one chunk; stream segments are merged in order, so there it
+    # spans the whole work unit.
+    dedup = {}
+    # "latest" merges need every newer users snapshot, not just the first one
+    versioned = ("users",) if WORKER_OPTIONS["merge_mode"] == "latest" else ()
+    version_key = user_version_key(WORKER_OPTIONS["timestamps"])
+    if WORKER_OPTIONS["dedup_entries"] > 0:
+        dedup = {t: DedupCache(WORKER_OPTIONS["dedup_entries"]) for t in PARENT_TABLES}
+
+    # Tweet ids already extracted in this work unit. Unlike the parent rows a
+    # tweet only has soft references pointing at it, so a skipped copy may
+    # have been emitted in any earlier chunk.
+    seen_tweets = None
+    if WORKER_OPTIONS["seen_tweets"] > 0:
+        seen_tweets = DedupCache(WORKER_OPTIONS["seen_tweets"])
+
+    def flush_batches():
+        # the writers take the tuples as they are: csv writes None as an
+        # empty field and BinaryCopyWriter as NULL
+        for t, batch in row_batches.items():
+            if not batch:
+                continue
+            cache = dedup.get(t)
+            out = batch
+            if cache is not None and t in versioned:
+                out = [r for r in batch if not cache.seen(r[0], version_key(r))]
+            elif cache is not None:
+                out = [r for r in batch if not cache.seen(r[0])]
+            writers[t].writerows(out)
+            written[t] += len(out)
+            batch.clear()
+
+    def emit_frame(reopen: bool):
+        nonlocal chunk_no
+        frame = {}
+        for t, f in files.items():
+            if stream:
+                if f.tell():
+                    data = f.getvalue()
+                    frame[t] = data if binary else data.encode("utf-8")
+                    written_bytes[t] += len(frame[t])
+                    f.seek(0)
+                    f.truncate()
+                continue
+            # binary COPY trailer, or the buffered Parquet row groups and footer
+            finish = getattr(writers[t], "finish", None)
+            if finish is not None:
+                finish()
+            if f.tell():
+                frame[t] = f.name
+                written_bytes[t] += f.tell()
+            f.close()
+            if t not in frame:
+                os.remove(f.name)
+
+        if not stream and reopen:
+            chunk_no += 1
+            open_outputs()
+            for cache in dedup.values():
+                cache.clear()
+
+        if not frame:
+            return
+        stats["frames"] += 1
+        if out_q is None:
+            produced.append(frame)
+            return
+        wait_start = time.time()
+        out_q.put((worker_id, frame))
+        stats["blocked"] += time.time() - wait_start
+
+    def release_buffers():
+        # what a worker holds in memory beyond its caches: the encoded rows
+        # of the open stream frame and buffered Parquet rows
+        if stream and sum(f.tell() for f in files.values()):
+            emit_frame(reopen=True)
+        for w in writers.values():
+            if isinstance(w, ParquetTableWriter):
+                w.flush()
 
     total = 0
-    for filepath in filepaths:
-        filepath = Path(filepath)
-        opener = gzip.open if filepath.suffix == ".gz" else open
-        with opener(filepath, "rt", encoding="utf-8", errors="replace") as fh:
-            for ln, rawline in enumerate(fh, start=1):
+    pending = 0
+    try:
+        for source in filepaths:
+            label = describe_unit(source)
+            for ln, rawline in iter_input_lines(source):
                 line = rawline.strip()
                 if not line:
                     continue
                 total += 1
                 try:
-                    line_clean = line.replace("\x00", "")
-                    j = orjson.loads(line_clean.encode("utf-8"))
+                    # returns line itself when there is no NUL
+                    j = orjson.loads(line.replace(b"\x00", b""))
                 except Exception as _:
+                    # invalid UTF-8 is replaced, as a text read of the file would
+                    text = line.decode("utf-8", errors="replace").replace("\x00", "")
                     try:
-                        j = orjson.loads(line.encode("utf-8"))
+                        j = orjson.loads(text)
                     except Exception as ex2:
-                        bad_f.write(f"{filepath}:{ln}: {ex2}\n{line}\n\n")
+                        bad_f.write(f"{label}:{ln}: {ex2}\n{text}\n\n")
+                        stats["bad_lines"] += 1
                         continue
 
-                rows = extract_from_tweet(j)
-                for t, recs in rows.items():
-                    batch = row_batches[t]
-                    for rec in recs:
-                        batch.append([("" if v is None else v) for v in rec])
-                        if len(batch) >= batch_size:
-                            writers[t].writerows(batch)
-                            batch.clear()
-
-    # Flushing remaining batches
-    for t, batch in row_batches.items():
-        if batch:
-            writers[t].writerows(batch)
-            batch.clear()
+                extract_from_tweet(j, seen=seen_tweets, rows=row_batches)
+                pending += 1
+
+                # batches hold the rows of batch_size tweets, chunks may only
+                # be cut between tweets
+                if pending >= governor.batch_size:
+                    pending = 0
+                    flush_batches()
+                    if governor.check():
+                        release_buffers()
+                    if out_q is not None and sum(f.tell() for f in files.values()) >= WORKER_OPTIONS["chunk_bytes"]:
+                        emit_frame(reopen=True)
+
+        # Flushing remaining batches
+        flush_batches()
+        emit_frame(reopen=False)
+    finally:
+        for f in files.values():
+            f.close()
+        bad_f.close()
+
+        gc.unfreeze()
+        gc.enable()
+
+    stats["lines"] = total
+    stats["rows"] = written
+    stats["bytes"] = written_bytes
+    stats["dedup_suppressed"] = {t: c.suppressed for t, c in dedup.items()}
+    stats["dedup_evicted"] = {t: c.evicted for t, c in dedup.items()}
+    if seen_tweets is not None:
+        stats["tweets_skipped"] = seen_tweets.suppressed
+        stats["tweets_seen_evicted"] = seen_tweets.evicted
+    memo = _hashtag_id.cache_info()
+    stats["hashtag_id_hits"] = memo.hits - memo_before.hits
+    stats["hashtag_id_misses"] = memo.misses - memo_before.misses
+    governor.check()
+    stats["pid"] = os.getpid()
+    stats["peak_rss"] = governor.peak
+    stats["over_budget"] = governor.over_budget
+    stats["gc_collections"] = governor.collections
+    stats["smallest_batch"] = governor.smallest_batch
+    stats["seconds"] = time.time() - started
+    if out_q is None:
+        stats["outputs"] = produced
+    return stats
+
+
+# Distinct tags sharing an id, within one batch or against the stored rows.
+# The merge would silently keep only one of them.
+HASHTAG_COLLISION_SQL = """
+    SELECT t.id, t.tag, h.tag
+    FROM (SELECT DISTINCT id, tag FROM {tmp}) t
+    JOIN hashtags h ON h.id = t.id AND h.tag <> t.tag
+    UNION
+    SELECT id, min(tag), max(tag)
+    FROM {tmp}
+    GROUP BY id
+    HAVING min(tag) <> max(tag);
+"""
+
+# (id, tag, other tag) of every collision found during the run
+HASHTAG_COLLISIONS: List[Tuple[int, str, str]] = []
+
+
+def record_hashtag_collisions(cur, tmp: str) -> None:
+    cur.execute(HASHTAG_COLLISION_SQL.format(tmp=tmp))
+    for hid, tag, other in cur.fetchall():
+        print(f"Hashtag id collision: {tag!r} and {other!r} both map to {hid}")
+        HASHTAG_COLLISIONS.append((hid, tag, other))
+
+
+def copy_sql_for(tmp: str, table_name: str) -> str:
+    """COPY of the TABLE_COLUMNS of table_name into tmp, a table LIKE it."""
+    target = f"{tmp} ({', '.join(TABLE_COLUMNS[table_name])})"
+    if MERGE_OPTIONS["copy_format"] == "binary":
+        return f"COPY {target} FROM STDIN WITH (FORMAT binary)"
+    return f"COPY {target} FROM STDIN WITH (FORMAT csv, DELIMITER E'{CSV_DELIMITER}', QUOTE '{CSV_QUOTECHAR}', ESCAPE '{CSV_ESCAPECHAR}', NULL '')"
+
+
+# What to do with the TMP_INDEX_MAP index of a temp table (--tmp-index), or
+# of each partition of a staging table with --merge-partitions:
+#   none         no index; the merge reads the temp table sequentially anyway
+#   before-copy  create it before the COPY, so every row maintains it
+#   after-copy   build it in one go after the COPY and ANALYZE the temp table
+#   sorted       no index, insert in primary key order for locality in the
+#                target's key index
+TMP_INDEX_STRATEGIES = ("none", "before-copy", "after-copy", "sorted")
+
+
+def parse_tmp_index(spec: str) -> Dict[str, str]:
+    """
+    Parse --tmp-index: a comma separated list of strategies for all tables
+    and/or table=strategy overrides, e.g. "none,tweets=sorted".
+    """
+    strategies = {}
+    default = "none"
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        table, _, strategy = part.rpartition("=")
+        if strategy not in TMP_INDEX_STRATEGIES or (table and table not in TABLE_COLUMNS):
+            raise argparse.ArgumentTypeError(f"invalid --tmp-index entry: {part}")
+        if table:
+            strategies[table] = strategy
+        else:
+            default = strategy
+    return {t: strategies.get(t, default) for t in TABLE_COLUMNS}
 
-    for f in files.values():
-        f.close()
-    bad_f.close()
 
-    gc.enable()
+def tmp_index_strategy(table_name: str) -> str:
+    return MERGE_OPTIONS["tmp_index"].get(table_name, "none")
 
-    return {t: str(out_dir / f"{t}__worker{worker_id}.tsv") for t in TABLE_COLS.keys()}
 
+def create_tmp_indexes(cur, tmp: str, index_cols) -> None:
+    for _, idx_def in enumerate(index_cols, start=1):
+        index_name, cols = idx_def
+        cur.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {tmp} {cols};")
 
-def load_table_files_to_db(
-    table_name, filepaths, db_dsn, index_cols=None, preceeding_query: str = None
-):
+
+def create_tmp_table(cur, table_name, index_cols=None) -> str:
+    """
+    Create the session-local temp table <tmp_table_name> mirroring table_name,
+    with the index_cols indexes when its --tmp-index strategy is before-copy.
     """
-    # Create a unique temp table on a fresh connection, COPY all filepaths into it,
-    # optionally create indexes on the temp table, then INSERT into <table_name>_staging.
-    # Returns number of rows inserted into staging (int).
-    #"""
+    tmp = f"tmp_{table_name}"
+    cur.execute(
+        f"CREATE TEMP TABLE {tmp} (LIKE {table_name} INCLUDING DEFAULTS EXCLUDING CONSTRAINTS);"
+    )
 
-    if not filepaths:
-        return 0
+    if index_cols and tmp_index_strategy(table_name) == "before-copy":
+        create_tmp_indexes(cur, tmp, index_cols)
 
-    tmp = f"tmp_{table_name}"
-    conn = psycopg2.connect(db_dsn)
+    return tmp
 
-    try:
-        with conn.cursor() as cur:
-            cur.execute(
-                f"CREATE TEMP TABLE {tmp} (LIKE {table_name} INCLUDING DEFAULTS EXCLUDING CONSTRAINTS);"
-            )
 
-            if index_cols:
-                for _, idx_def in enumerate(index_cols, start=1):
-                    index_name, cols = idx_def
-                    cur.execute(
-                        f"CREATE INDEX IF NOT EXISTS {index_name} ON {tmp} {cols};"
-                    )
+def merge_insert_sql(table_name: str, tmp: str) -> str:
+    """INSERT moving tmp into table_name according to MERGE_OPTIONS."""
+    order = ""
+    if tmp_index_strategy(table_name) == "sorted":
+        # ctid keeps duplicates in COPY order, so the first one loaded still wins
+        order = f" ORDER BY {', '.join(PRIMARY_KEYS[table_name])}, ctid"
+    if MERGE_OPTIONS["bulk"]:
+        return f"INSERT INTO {table_name} SELECT * FROM {tmp}{order};"
+    if MERGE_OPTIONS["mode"] == "latest" and table_name in LATEST_MERGE_SQL:
+        # already ordered by id for DISTINCT ON
+        return LATEST_MERGE_SQL[table_name].format(tmp=tmp)
+    return f"INSERT INTO {table_name} SELECT * FROM {tmp}{order} ON CONFLICT DO NOTHING;"
 
-            copy_sql = f"COPY {tmp} FROM STDIN WITH (FORMAT csv, DELIMITER E'{CSV_DELIMITER}', QUOTE '{CSV_QUOTECHAR}', ESCAPE '{CSV_ESCAPECHAR}', NULL '')"
 
-            for fp in filepaths:
-                with open(fp, "r", encoding="utf-8", newline="") as fh:
-                    cur.copy_expert(copy_sql, fh)
+def merge_tmp_table(cur, table_name, preceeding_query: str = None, index_cols=None) -> int:
+    """
+    Insert tmp_<table_name> into table_name, drop it and return its row count.
+    With the after-copy strategy the index_cols indexes are built first.
+    """
+    tmp = f"tmp_{table_name}"
 
-            if preceeding_query:
-                cur.execute(preceeding_query)
+    if index_cols and tmp_index_strategy(table_name) == "after-copy":
+        create_tmp_indexes(cur, tmp, index_cols)
+        cur.execute(f"ANALYZE {tmp};")
 
-            cur.execute(
-                f"INSERT INTO {table_name} SELECT * FROM {tmp} ON CONFLICT DO NOTHING;"
-            )
+    if preceeding_query:
+        cur.execute(preceeding_query.format(tmp=tmp))
 
-            cur.execute(f"SELECT COUNT(*) FROM {tmp};")
+    if table_name == "hashtags":
+        record_hashtag_collisions(cur, tmp)
 
-            cnt = cur.fetchone()[0]
-            # dropping tmp
-            cur.execute(f"DROP TABLE {tmp};")
-            conn.commit()
-            return cnt
-    except Exception:
-        conn.rollback()
-        raise
-    finally:
-        conn.close()
+    cur.execute(merge_insert_sql(table_name, tmp))
+
+    cur.execute(f"SELECT COUNT(*) FROM {tmp};")
+
+    cnt = cur.fetchone()[0]
+    # dropping tmp
+    cur.execute(f"DROP TABLE {tmp};")
+    return cnt
 
 
 # --------------------------
-# Merge orchestration (dependency-aware)
+# Merge connections
 # --------------------------
-def run_merge_plan(db_dsn, table_to_files: dict, index_map=None, max_workers=4):
+class MergePool(ThreadedConnectionPool):
     """
-    Run merges in parallel where possible.
-    Assumes you have functions:
-      - merge_users(conn)  or inline SQL that merges users_staging->users
-      - merge_places(conn)
-      - merge_hashtags(conn)
-      - merge_tweets_in_batches(conn, batch_size)
-      - merge_mentions_with_hash_buckets(conn, buckets)
-      - merge_tweet_urls(conn)
-      - merge_tweet_media(conn)
-      - merge_tweet_hashtag(conn)
-    These functions should accept a DB connection or use a new connection inside them.
-    """
-
-    def _run(fn, *args, **kwargs):
-        # If function expects its own connection, just calling it
-        if fn.__name__.startswith("load_"):
-            return fn(*args, **kwargs)
-        # Else, giving it a connection
-        conn = psycopg2.connect(db_dsn)
+    Connection pool of the merge phase. Every connection starts with the
+    bulk-load session settings (passed as libpq options, so they cost no
+    extra round trip), getconn blocks instead of failing when all maxconn
+    connections are in use, and opened counts the connections made.
+    """
+
+    def __init__(self, maxconn: int, db_dsn, settings: Dict[str, str]):
+        self.opened = 0
+        self.opened_lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(maxconn)
+        options = " ".join(f"-c {k}={v}" for k, v in settings.items())
+        # psycopg2 only keeps up to minconn idle connections, so all of them
+        # are opened upfront
+        super().__init__(maxconn, maxconn, db_dsn, options=options)
+
+    def _connect(self, key=None):
+        with self.opened_lock:
+            self.opened += 1
+        return super()._connect(key)
+
+    def getconn(self, key=None):
+        self.slots.acquire()
         try:
-            with conn.cursor() as cur:
-                cur.execute("SET LOCAL synchronous_commit = OFF;")
-            fn(conn, *args, **kwargs)
+            return super().getconn(key)
+        except Exception:
+            self.slots.release()
+            raise
+
+    def putconn(self, conn, key=None, close=False):
+        try:
+            super().putconn(conn, key, close)
         finally:
-            conn.close()
+            self.slots.release()
 
-    parent_tasks = {
-        "users": (
-            load_table_files_to_db,
-            ("users", table_to_files["users"], db_dsn, index_map.get("users")),
-        ),
-        "places": (
-            load_table_files_to_db,
-            ("places", table_to_files["places"], db_dsn, index_map.get("places")),
-        ),
-        "hashtags": (
-            load_table_files_to_db,
-            ("hashtags", table_to_files["hashtags"], db_dsn, index_map.get("hashtags")),
-        ),
-    }
 
-    tweet_task = (
-        "tweets",
-        (
-            load_table_files_to_db,
-            ("tweets", table_to_files["tweets"], db_dsn, index_map.get("tweets")),
-        ),
-    )
+# well below the default max_connections of 100
+MAX_MERGE_CONNECTIONS = 48
 
-    child_tasks = {
-        "tweet_urls": (
-            load_table_files_to_db,
-            (
-                "tweet_urls",
-                table_to_files["tweet_urls"],
-                db_dsn,
-                index_map.get("tweet_urls"),
-            ),
-        ),
-        "tweet_media": (
-            load_table_files_to_db,
-            (
-                "tweet_media",
-                table_to_files["tweet_media"],
-                db_dsn,
-                index_map.get("tweet_media"),
-            ),
-        ),
-        "tweet_hashtag": (
-            load_table_files_to_db,
-            (
-                "tweet_hashtag",
-                table_to_files["tweet_hashtag"],
-                db_dsn,
-                index_map.get("tweet_hashtag"),
-            ),
-        ),
-        "tweet_user_mentions": (
-            load_table_files_to_db,
-            (
-                "tweet_user_mentions",
-                table_to_files["tweet_user_mentions"],
-                db_dsn,
-                index_map.get("tweet_user_mentions"),
-                """
-                    INSERT INTO users (id, screen_name, name)
-                    SELECT mentioned_user_id, mentioned_screen_name, mentioned_name
-                    FROM tmp_tweet_user_mentions
-                    ON CONFLICT (id) DO NOTHING;
-                """,
-            ),
-        ),
+# Set by open_merge_pool for the run, merges connect directly while None
+MERGE_POOL: Optional[MergePool] = None
+
+
+def session_settings(args) -> Dict[str, str]:
+    return {
+        "synchronous_commit": "off",
+        "work_mem": args.merge_work_mem,
+        "maintenance_work_mem": args.merge_maintenance_work_mem,
+        "temp_buffers": args.merge_temp_buffers,
     }
 
-    # runing parent tasks in parallel
-    with ThreadPoolExecutor(max_workers=max_workers) as ex:
-        parent_futs = {
-            ex.submit(_run, fn, *args): name
-            for name, (fn, args) in parent_tasks.items()
-        }
-        for fut in as_completed(parent_futs):
-            name = parent_futs[fut]
-            try:
-                fut.result()
-                print(f"Merge parent {name} done")
-            except Exception as e:
-                print(f"Parent merge {name} failed: {e}")
-                raise
 
-    # merging tweets
-    _run(*tweet_task[1]) if False else _run(tweet_task[1][0], *tweet_task[1][1])
-    print("Merge tweets done")
+def open_merge_pool(db_dsn, args) -> MergePool:
+    """
+    Create MERGE_POOL, big enough that no merge ever waits for a connection:
+    every merge thread runs up to four tables at once, each on one connection
+    or on one per partition, and --stream-copy keeps one connection per table
+    on top. Capped at MAX_MERGE_CONNECTIONS; partition merges hold nothing
+    else while they wait for a connection, so a smaller pool only queues them.
+    """
+    global MERGE_POOL
+    per_table = max(args.merge_partitions, 1)
+    parallel_tables = min(args.workers, len(CHILD_TABLES))
+    if args.stream_copy:
+        maxconn = len(TABLE_COLS) + (parallel_tables * per_table if per_table > 1 else 0)
+    else:
+        maxconn = args.merge_threads * parallel_tables * per_table
+    maxconn = min(maxconn, max(MAX_MERGE_CONNECTIONS, len(TABLE_COLS) + 1))
+    MERGE_POOL = MergePool(maxconn, db_dsn, session_settings(args))
+    return MERGE_POOL
 
-    # running child tasks in parallel
-    with ThreadPoolExecutor(max_workers=max_workers) as ex:
-        child_futs = {
-            ex.submit(_run, fn, *args): name for name, (fn, args) in child_tasks.items()
-        }
-        for fut in as_completed(child_futs):
-            name = child_futs[fut]
-            try:
-                fut.result()
-                print(f"Merge child {name} done")
-            except Exception as e:
-                print(f"Child merge {name} failed: {e}")
-                raise
 
+def close_merge_pool() -> int:
+    """Close MERGE_POOL and return the number of connections it opened."""
+    global MERGE_POOL
+    if MERGE_POOL is None:
+        return 0
+    opened = MERGE_POOL.opened
+    MERGE_POOL.closeall()
+    MERGE_POOL = None
+    return opened
 
-def start_iter(args, files):
-    print("Temporary files will be written to", args.tmp_dir or "(temp dir)")
+
+def get_merge_connection(db_dsn):
+    if MERGE_POOL is None:
+        return psycopg2.connect(db_dsn)
+    return MERGE_POOL.getconn()
+
+
+def put_merge_connection(conn, broken: bool = False) -> None:
+    """Return conn to MERGE_POOL, closing it when broken or not pooled."""
+    if MERGE_POOL is None:
+        conn.close()
+    else:
+        MERGE_POOL.putconn(conn, close=broken or conn.closed != 0)
+
+
+@contextmanager
+def merge_connection(db_dsn):
+    """A merge connection for one transaction; rolled back if the body fails."""
+    conn = get_merge_connection(db_dsn)
+    broken = False
+    try:
+        yield conn
+    except BaseException:
+        broken = conn.closed != 0
+        if not broken:
+            conn.rollback()
+        raise
+    finally:
+        put_merge_connection(conn, broken)
+
+
+def retry_on_deadlock(fn: Callable[[], Any], label: str) -> Any:
+    """Run fn, again when it lost a deadlock, up to DEADLOCK_RETRIES times."""
+    # concurrent merges of overlapping keys may deadlock, the loser just retries
+    for attempt in range(1, DEADLOCK_RETRIES + 1):
+        try:
+            return fn()
+        except psycopg2.OperationalError as e:
+            if e.pgcode != errorcodes.DEADLOCK_DETECTED or attempt == DEADLOCK_RETRIES:
+                raise
+            print(f"Deadlock while merging {label}, retrying ({attempt})")
+
+
+# --------------------------
+# Partitioned merges
+# --------------------------
+# With --merge-partitions N > 1 the batches of these tables are COPYed into a
+# regular staging table hash partitioned on the key below, visible to every
+# connection, and the N partitions are merged concurrently on separate pool
+# connections. Keys are disjoint between partitions, so they never conflict.
+PARTITION_KEYS = {
+    "tweets": "id",
+    "tweet_hashtag": "tweet_id",
+    "tweet_urls": "tweet_id",
+    "tweet_user_mentions": "tweet_id",
+    "tweet_media": "tweet_id",
+}
+STAGE_PREFIX = "merge_stage_"
+_stage_ids = itertools.count(1)
+
+# table -> partitioned merges, their wall seconds and the summed seconds of
+# their partitions (what a serial merge would have taken)
+PARTITION_STATS: Dict[str, Dict[str, float]] = {}
+_partition_stats_lock = threading.Lock()
+
+# table -> loads, rows, bytes and seconds spent in COPY and in the merge
+# INSERT, summed over all chunks / segments of the run
+TABLE_STATS: Dict[str, Dict[str, float]] = {}
+_table_stats_lock = threading.Lock()
+
+
+def record_table_stats(table_name: str, **counts: float) -> None:
+    with _table_stats_lock:
+        st = TABLE_STATS.setdefault(
+            table_name, {"loads": 0, "rows": 0, "bytes": 0, "copy_seconds": 0.0, "merge_seconds": 0.0}
+        )
+        for k, v in counts.items():
+            st[k] += v
+
+
+def is_partitioned(table_name: str) -> bool:
+    return MERGE_OPTIONS["partitions"] > 1 and table_name in PARTITION_KEYS
+
+
+def stage_index_sql(part: str, index_cols) -> List[str]:
+    """
+    CREATE INDEX statements of the index_cols indexes on a staging table
+    partition. Unlike temp tables these share the schema with concurrent
+    merges, so the indexes are named after the (unique) partition; names
+    Postgres generates are truncated and may collide.
+    """
+    return [f"CREATE INDEX {part}_idx{i} ON {part} {cols};" for i, (_, cols) in enumerate(index_cols or ())]
+
+
+def create_stage_table(cur, table_name: str, index_cols=None) -> str:
+    """
+    Create a hash partitioned staging table for table_name, return its name.
+    With the before-copy strategy every partition gets the index_cols indexes.
+    """
+    stage = f"{STAGE_PREFIX}{table_name}_{os.getpid()}_{next(_stage_ids)}"
+    n = MERGE_OPTIONS["partitions"]
+    cur.execute(
+        f"CREATE TABLE {stage} (LIKE {table_name} INCLUDING DEFAULTS EXCLUDING CONSTRAINTS) "
+        f"PARTITION BY HASH ({PARTITION_KEYS[table_name]});"
+    )
+    for k in range(n):
+        cur.execute(
+            f"CREATE UNLOGGED TABLE {stage}_p{k} PARTITION OF {stage} "
+            f"FOR VALUES WITH (MODULUS {n}, REMAINDER {k});"
+        )
+        if tmp_index_strategy(table_name) == "before-copy":
+            for sql in stage_index_sql(f"{stage}_p{k}", index_cols):
+                cur.execute(sql)
+    return stage
+
+
+def merge_stage_table(
+    db_dsn, table_name: str, stage: str, preceeding_query: str = None, index_cols=None
+) -> int:
+    """
+    Merge the committed staging table stage into table_name, one partition
+    per connection, then drop it and return its row count. With the
+    after-copy strategy every partition first gets the index_cols indexes
+    and is analyzed, on its own connection.
+    """
+    n = MERGE_OPTIONS["partitions"]
+    started = time.time()
+
+    def run(sql_list):
+        def attempt():
+            with merge_connection(db_dsn) as conn, conn.cursor() as cur:
+                part_start = time.time()
+                for sql in sql_list:
+                    cur.execute(sql)
+                conn.commit()
+                return time.time() - part_start
+
+        return retry_on_deadlock(attempt, table_name)
+
+    if preceeding_query:
+        run([preceeding_query.format(tmp=stage)])
+
+    def partition_sql(part: str) -> List[str]:
+        sql = []
+        if tmp_index_strategy(table_name) == "after-copy":
+            sql += stage_index_sql(part, index_cols) + [f"ANALYZE {part};"]
+        return sql + [merge_insert_sql(table_name, part)]
+
+    with ThreadPoolExecutor(max_workers=n) as ex:
+        work = sum(ex.map(run, [partition_sql(f"{stage}_p{k}") for k in range(n)]))
+
+    with merge_connection(db_dsn) as conn, conn.cursor() as cur:
+        cur.execute(f"SELECT COUNT(*) FROM {stage};")
+        cnt = cur.fetchone()[0]
+        cur.execute(f"DROP TABLE {stage};")
+        conn.commit()
+
+    wall = time.time() - started
+    with _partition_stats_lock:
+        st = PARTITION_STATS.setdefault(table_name, {"merges": 0, "wall": 0.0, "work": 0.0})
+        st["merges"] += 1
+        st["wall"] += wall
+        st["work"] += work
+    record_table_stats(table_name, rows=cnt, merge_seconds=wall)
+    return cnt
+
+
+def drop_stale_stage_tables(cur) -> None:
+    """Drop staging tables a crashed run left behind."""
+    cur.execute(
+        "SELECT relname FROM pg_class WHERE relkind = 'p' AND relname LIKE %s;",
+        (STAGE_PREFIX.replace("_", "\\_") + "%",),
+    )
+    for (name,) in cur.fetchall():
+        cur.execute(f"DROP TABLE IF EXISTS {name};")
+
+
+def print_partition_summary() -> None:
+    if not PARTITION_STATS:
+        return
+    print(f"\nPartitioned merges ({MERGE_OPTIONS['partitions']} partitions):")
+    for t, st in PARTITION_STATS.items():
+        speedup = st["work"] / st["wall"] if st["wall"] else 0.0
+        print(
+            f"  {t}: {st['merges']:.0f} merges, {st['work']:.1f}s of partition work "
+            f"in {st['wall']:.1f}s wall ({speedup:.1f}x parallel)"
+        )
+
+
+def print_table_summary() -> None:
+    """Print rows, bytes, COPY throughput and merge time per table."""
+    if not TABLE_STATS:
+        return
+    print("\nPer-table load:")
+    for t in TABLE_COLS:
+        st = TABLE_STATS.get(t)
+        if st is None:
+            continue
+        rate = st["rows"] / st["copy_seconds"] if st["copy_seconds"] else 0.0
+        print(
+            f"  {t}: {st['rows']:.0f} rows, {st['bytes'] / 1e6:.1f} MB in {st['loads']:.0f} loads, "
+            f"COPY {st['copy_seconds']:.1f}s ({rate:,.0f} rows/s), merge {st['merge_seconds']:.1f}s"
+        )
+
+
+def load_table_files_to_db(
+    table_name, filepaths, db_dsn, index_cols=None, preceeding_query: str = None
+):
+    """
+    COPY the worker files of table_name (TSV/CSV, or binary COPY for .bin
+    files) into a temp table on a MERGE_POOL connection, with the index_cols
+    indexes per the --tmp-index strategy, then merge it into table_name and
+    return the merged row count. The connection is rolled back if the load
+    fails and goes back to the pool either way. A partitioned table is
+    staged in a committed stage table instead and merged by
+    merge_stage_table, one pooled connection per partition.
+    """
+
+    if not filepaths:
+        return 0
+
+    partitioned = is_partitioned(table_name)
+
+    def load():
+        with merge_connection(db_dsn) as conn, conn.cursor() as cur:
+            if partitioned:
+                tmp = create_stage_table(cur, table_name, index_cols)
+            else:
+                tmp = create_tmp_table(cur, table_name, index_cols)
+            copy_sql = copy_sql_for(tmp, table_name)
+
+            copy_start = time.time()
+            copied = 0
+            for fp in filepaths:
+                copied += os.path.getsize(fp)
+                if fp.endswith(".bin"):
+                    fh = open(fp, "rb")
+                else:
+                    fh = open(fp, "r", encoding="utf-8", newline="")
+                with fh:
+                    cur.copy_expert(copy_sql, fh)
+            copy_seconds = time.time() - copy_start
+
+            if partitioned:
+                conn.commit()
+                # rows and merge time are recorded by merge_stage_table
+                record_table_stats(table_name, loads=1, bytes=copied, copy_seconds=copy_seconds)
+                return tmp
+            merge_start = time.time()
+            cnt = merge_tmp_table(cur, table_name, preceeding_query, index_cols)
+            conn.commit()
+            record_table_stats(
+                table_name,
+                loads=1,
+                rows=cnt,
+                bytes=copied,
+                copy_seconds=copy_seconds,
+                merge_seconds=time.time() - merge_start,
+            )
+            return cnt
+
+    if partitioned:
+        stage = load()
+        return merge_stage_table(db_dsn, table_name, stage, preceeding_query, index_cols)
+    return retry_on_deadlock(load, table_name)
+
+
+class StreamingTableLoader:
+    """
+    Streams worker output for one table straight into COPY ... FROM STDIN.
+
+    The loader holds one MERGE_POOL connection until close() (temp tables are
+    session-local) and a bounded queue of encoded chunks which a background
+    thread hands to copy_expert through the file-like read() below. feed()
+    blocks while the queue is full, which is what propagates backpressure to
+    the workers.
+    Data is loaded in segments: open_segment() starts a COPY into a fresh temp
+    table, close_segment() ends it and merge() moves the rows into the target.
+    """
+
+    def __init__(
+        self,
+        table_name,
+        db_dsn,
+        queue_depth: int,
+        index_cols=None,
+        preceeding_query: str = None,
+    ):
+        self.table_name = table_name
+        self.index_cols = index_cols
+        self.preceeding_query = preceeding_query
+        self.db_dsn = db_dsn
+        self.conn = get_merge_connection(db_dsn)
+        self.stage = None
+        self.cur = None
+        self.chunks = queue.Queue(maxsize=queue_depth)
+        self.thread = None
+        self.copy_data = None
+        self.error = None
+        self.rows = 0
+        self.segment_bytes = 0
+        self.copy_seconds = 0.0
+
+    def _iter_copy_data(self):
+        binary = MERGE_OPTIONS["copy_format"] == "binary"
+        if binary:
+            yield BINARY_COPY_HEADER
+        while True:
+            chunk = self.chunks.get()
+            if chunk is None:
+                break
+            yield chunk
+        if binary:
+            yield BINARY_COPY_TRAILER
+
+    def read(self, size=-1):
+        return next(self.copy_data, b"")
+
+    def _copy(self, tmp):
+        # includes the time the COPY waited for frames from the workers
+        copy_start = time.time()
+        try:
+            self.cur.copy_expert(copy_sql_for(tmp, self.table_name), self)
+        except Exception as e:
+            self.error = e
+        self.copy_seconds = time.time() - copy_start
+
+    def open_segment(self):
+        self.cur = self.conn.cursor()
+        if is_partitioned(self.table_name):
+            tmp = self.stage = create_stage_table(self.cur, self.table_name, self.index_cols)
+        else:
+            tmp = create_tmp_table(self.cur, self.table_name, self.index_cols)
+        self.copy_data = self._iter_copy_data()
+        self.thread = threading.Thread(target=self._copy, args=(tmp,), daemon=True)
+        self.thread.start()
+
+    def feed(self, chunk: Optional[bytes]):
+        while True:
+            if self.error is not None:
+                raise self.error
+            try:
+                self.chunks.put(chunk, timeout=1)
+                if chunk is not None:
+                    self.segment_bytes += len(chunk)
+                return
+            except queue.Full:
+                continue
+
+    def close_segment(self):
+        self.feed(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+        record_table_stats(
+            self.table_name, loads=1, bytes=self.segment_bytes, copy_seconds=self.copy_seconds
+        )
+        self.segment_bytes = 0
+
+    def merge(self) -> int:
+        merge_start = time.time()
+        try:
+            if self.stage is not None:
+                # the partitions are merged on pool connections, which only
+                # see the staging table once the COPY is committed
+                self.conn.commit()
+                cnt = merge_stage_table(
+                    self.db_dsn, self.table_name, self.stage, self.preceeding_query, self.index_cols
+                )
+                self.stage = None
+            else:
+                cnt = merge_tmp_table(
+                    self.cur, self.table_name, self.preceeding_query, self.index_cols
+                )
+                self.conn.commit()
+                record_table_stats(
+                    self.table_name, rows=cnt, merge_seconds=time.time() - merge_start
+                )
+        except Exception:
+            self.conn.rollback()
+            raise
+        self.cur.close()
+        self.rows += cnt
+        return cnt
+
+    def close(self):
+        # a connection left inside a failed COPY or merge is not reused
+        ready = self.conn.closed == 0 and self.conn.status == psycopg2.extensions.STATUS_READY
+        put_merge_connection(self.conn, broken=not ready)
+
+
+# --------------------------
+# Merge orchestration (dependency-aware)
+# --------------------------
+PARENT_TABLES = ("users", "places", "hashtags")
+CHILD_TABLES = ("tweet_urls", "tweet_media", "tweet_hashtag", "tweet_user_mentions")
+
+# Executed on the merge connection right before the INSERT from the temp
+# table, {tmp} is replaced by its name
+PRECEDING_QUERIES = {
+    "tweet_user_mentions": """
+        INSERT INTO users (id, screen_name, name)
+        SELECT mentioned_user_id, mentioned_screen_name, mentioned_name
+        FROM {tmp}
+        ON CONFLICT (id) DO NOTHING;
+    """,
+}
+
+# --bulk-initial variants: there are no unique indexes to conflict on yet,
+# duplicates are removed by dedupe_bulk_tables before the keys are built
+BULK_PRECEDING_QUERIES = {
+    "tweet_user_mentions": """
+        INSERT INTO users (id, screen_name, name)
+        SELECT DISTINCT ON (mentioned_user_id)
+            mentioned_user_id, mentioned_screen_name, mentioned_name
+        FROM {tmp}
+        ORDER BY mentioned_user_id, ctid;
+    """,
+}
+
+PRIMARY_KEYS = {
+    "users": ("id",),
+    "places": ("id",),
+    "tweets": ("id",),
+    "hashtags": ("id",),
+    "tweet_hashtag": ("tweet_id", "hashtag_id"),
+    "tweet_urls": ("tweet_id", "url"),
+    "tweet_user_mentions": ("tweet_id", "mentioned_user_id"),
+    "tweet_media": ("tweet_id", "media_id"),
+}
+
+
+def preceding_query_for(table_name: str) -> Optional[str]:
+    if MERGE_OPTIONS["bulk"]:
+        return BULK_PRECEDING_QUERIES.get(table_name)
+    return PRECEDING_QUERIES.get(table_name)
+
+# Merge settings of the run, set by configure_merge
+MERGE_OPTIONS: Dict[str, Any] = {
+    "mode": "first",
+    "bulk": False,
+    "copy_format": "csv",
+    "partitions": 1,
+    "tmp_index": {},
+}
+
+_USER_UPDATE_COLS = ", ".join(
+    f"{c} = EXCLUDED.{c}" for c in TABLE_COLUMNS["users"] if c != "id"
+)
+_TWEET_MAX_COLS = ", ".join(
+    f"max({c}) OVER (PARTITION BY id)" if c in ("retweet_count", "favorite_count") else c
+    for c in TABLE_COLUMNS["tweets"]
+)
+
+# Version order of the users rows of one id under --merge-mode latest: the
+# snapshot time (of the tweet the profile came with), then the counters and
+# the remaining columns as tiebreakers. It covers every column but id, so
+# equal versions are identical rows and the row kept does not depend on the
+# chunk, shard or worker layout. (column, value standing in for NULL)
+USER_VERSION_COLUMNS = (
+    ("snapshot_at", "'-infinity'::timestamp"),
+    ("statuses_count", "-1"),
+    ("followers_count", "-1"),
+    ("friends_count", "-1"),
+    ("created_at", "'-infinity'::timestamp"),
+    ("verified", "false"),
+    ("protected", "false"),
+    ("screen_name", "''"),
+    ("name", "''"),
+    ("description", "''"),
+    ("location", "''"),
+    ("url", "''"),
+)
+
+
+def user_version_sql(alias: str) -> List[str]:
+    """USER_VERSION_COLUMNS of the users row alias as SQL expressions."""
+    types = dict(zip(TABLE_COLUMNS["users"], COLUMN_TYPES["users"]))
+    exprs = []
+    for col, null in USER_VERSION_COLUMNS:
+        expr = f"COALESCE({alias}.{col}, {null})"
+        # byte order, which is the code point order Python compares str by
+        exprs.append(f'{expr} COLLATE "C"' if types[col] == "text" else expr)
+    return exprs
+
+
+def user_version_order(alias: str) -> str:
+    """ORDER BY terms putting the newest version of a users row first."""
+    return ", ".join(f"{e} DESC" for e in user_version_sql(alias))
+
+
+def user_version_key(timestamps: str) -> Callable[[Tuple], Tuple]:
+    """
+    Key of a worker users row (timestamps in that --timestamps format) that
+    orders versions like user_version_sql. Empty values are NULL once loaded
+    and compare lowest, like the NULL stand-ins.
+    """
+    columns = TABLE_COLUMNS["users"]
+    types = dict(zip(columns, COLUMN_TYPES["users"]))
+    by_type = {
+        "timestamp": TIMESTAMP_SORT_KEYS[timestamps],
+        "int4": lambda v: -1 if v is None or v == "" else v,
+        "bool": bool,
+        "text": lambda v: v or "",
+    }
+    parts = [(columns.index(col), by_type[types[col]]) for col, _ in USER_VERSION_COLUMNS]
+    return lambda row: tuple(key(row[i]) for i, key in parts)
+
+
+# --merge-mode latest: one set-based statement per batch that keeps the newest
+# users version (USER_VERSION_COLUMNS) and the highest tweet counters, both
+# within the batch (DISTINCT ON / window max) and against stored rows
+LATEST_MERGE_SQL = {
+    "users": f"""
+        INSERT INTO users AS u
+        SELECT DISTINCT ON (id) * FROM {{tmp}} s
+        ORDER BY id, {user_version_order("s")}
+        ON CONFLICT (id) DO UPDATE SET
+            {_USER_UPDATE_COLS}
+        WHERE ({", ".join(user_version_sql("u"))})
+            < ({", ".join(user_version_sql("EXCLUDED"))});
+    """,
+    "tweets": f"""
+        INSERT INTO tweets AS t
+        SELECT DISTINCT ON (id)
+            {_TWEET_MAX_COLS}
+        FROM {{tmp}}
+        ORDER BY id
+        ON CONFLICT (id) DO UPDATE SET
+            retweet_count = GREATEST(t.retweet_count, EXCLUDED.retweet_count),
+            favorite_count = GREATEST(t.favorite_count, EXCLUDED.favorite_count)
+        WHERE t.retweet_count IS DISTINCT FROM GREATEST(t.retweet_count, EXCLUDED.retweet_count)
+            OR t.favorite_count IS DISTINCT FROM GREATEST(t.favorite_count, EXCLUDED.favorite_count);
+    """,
+}
+
+
+def configure_merge(args) -> None:
+    MERGE_OPTIONS["mode"] = args.merge_mode
+    MERGE_OPTIONS["bulk"] = args.bulk_initial
+    MERGE_OPTIONS["copy_format"] = args.copy_format
+    MERGE_OPTIONS["partitions"] = args.merge_partitions
+    MERGE_OPTIONS["tmp_index"] = args.tmp_index
+
+
+def prepare_database(db_dsn) -> None:
+    """Bring databases created from an older database_schema.sql up to date."""
+    conn = psycopg2.connect(db_dsn)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS snapshot_at TIMESTAMP;")
+            cur.execute(MANIFEST_TABLE_SQL)
+            drop_stale_stage_tables(cur)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def check_hashtag_id_version(db_dsn, version: int, sample: int = 100) -> None:
+    """
+    Refuse to load with a --hashtag-id-version other than the one the stored
+    hashtags were created with; the same tag would get a second id.
+    """
+    conn = psycopg2.connect(db_dsn)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"SELECT id, tag FROM hashtags LIMIT {sample};")
+            rows = cur.fetchall()
+    finally:
+        conn.close()
+
+    matching = [
+        v
+        for v in HASHTAG_ID_VERSIONS
+        if all(hashtag_id_from_tag(tag, v) == hid for hid, tag in rows)
+    ]
+    if rows and version not in matching:
+        found = f"version {matching[0]}" if matching else "an unknown scheme"
+        print(
+            f"--hashtag-id-version {version} does not match the stored hashtags ({found})"
+        )
+        sys.exit(1)
+
+
+def start_bulk_initial(db_dsn) -> None:
+    """
+    --bulk-initial: make sure the constraints of the (empty) tables are
+    deferred, unless import_schema.py --bulk-initial already did so.
+    """
+    conn = psycopg2.connect(db_dsn)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT to_regclass('deferred_constraints') IS NOT NULL;")
+            if not cur.fetchone()[0]:
+                for t in TABLE_COLUMNS:
+                    cur.execute(f"SELECT EXISTS (SELECT 1 FROM {t});")
+                    if cur.fetchone()[0]:
+                        print(f"--bulk-initial needs empty tables, but {t} has rows")
+                        sys.exit(1)
+        count = defer_constraints(conn)
+    finally:
+        conn.close()
+    if count:
+        print(f"Deferred {count} constraints and indexes until the end of the load")
+
+
+def dedupe_bulk_tables(db_dsn, max_workers=4) -> None:
+    """
+    Remove the duplicate keys a --bulk-initial load inserted, keeping the row
+    the regular merge would keep. That is the first row loaded (ON CONFLICT
+    DO NOTHING), except with --merge-mode latest, which keeps the newest users
+    version (USER_VERSION_COLUMNS) and the highest tweet counters. Tables run
+    in parallel.
+    """
+    latest = MERGE_OPTIONS["mode"] == "latest"
+
+    def dedupe(table_name):
+        keys = ", ".join(PRIMARY_KEYS[table_name])
+        # every chunk of a table is loaded in its own transaction, so the
+        # oldest inserting transaction (then COPY order) is the first merged
+        order = "age(s.xmin) DESC, s.ctid"
+        if latest and table_name == "users":
+            order = user_version_order("s")
+        conn = psycopg2.connect(db_dsn)
+        try:
+            with conn.cursor() as cur:
+                if table_name == "tweets" and latest:
+                    cur.execute(
+                        """
+                        UPDATE tweets t
+                        SET retweet_count = m.retweet_count, favorite_count = m.favorite_count
+                        FROM (
+                            SELECT id, max(retweet_count) AS retweet_count,
+                                max(favorite_count) AS favorite_count
+                            FROM tweets GROUP BY id HAVING COUNT(*) > 1
+                        ) m
+                        WHERE t.id = m.id;
+                        """
+                    )
+                cur.execute(
+                    f"""
+                    DELETE FROM {table_name} t
+                    USING (
+                        SELECT s.ctid, row_number() OVER (PARTITION BY {keys} ORDER BY {order}) AS rn
+                        FROM {table_name} s
+                    ) d
+                    WHERE t.ctid = d.ctid AND d.rn > 1;
+                    """
+                )
+                removed = cur.rowcount
+            conn.commit()
+        finally:
+            conn.close()
+        print(f"Removed {removed} duplicate {table_name} rows")
+
+    with ThreadPoolExecutor(max_workers=max_workers) as ex:
+        list(ex.map(dedupe, TABLE_COLUMNS))
+
+
+def finish_bulk_initial(db_dsn, args) -> None:
+    """--bulk-initial: deduplicate, then build keys, indexes and foreign keys once."""
+    dedupe_start = time.time()
+    dedupe_bulk_tables(db_dsn, max_workers=args.workers)
+    print(f"Phase dedupe: {time.time() - dedupe_start:.1f} seconds")
+    restore_constraints(
+        db_dsn, workers=args.workers, maintenance_workers=args.maintenance_workers
+    )
+
+
+# Index definitions for temp tables (for faster merge/update)
+TMP_INDEX_MAP = {
+    "users": [("users_tmp_idx", "(id)")],
+    "places": [("places_tmp_idx", "(id)")],
+    "tweets": [("tweets_tmp_idx", "(id)")],
+    "hashtags": [("hashtags_tmp_idx", "(id)")],
+    "tweet_hashtag": [("tweet_hashtag_tmp_idx", "(tweet_id, hashtag_id)")],
+    "tweet_urls": [("tweet_urls_tmp_idx", "(tweet_id, url)")],
+    "tweet_user_mentions": [
+        ("tweet_user_mentions_tmp_idx", "(tweet_id, mentioned_user_id)")
+    ],
+    "tweet_media": [("tweet_media_tmp_idx", "(tweet_id, media_id)")],
+}
+
+
+def run_in_dependency_order(tasks: Dict[str, Callable[[], Any]], max_workers=4):
+    """
+    Run one merge callable per table: parent tables in parallel, then tweets,
+    then the child tables in parallel, so foreign keys are always satisfied.
+    """
+    # runing parent tasks in parallel
+    with ThreadPoolExecutor(max_workers=max_workers) as ex:
+        parent_futs = {ex.submit(tasks[name]): name for name in PARENT_TABLES}
+        for fut in as_completed(parent_futs):
+            name = parent_futs[fut]
+            try:
+                fut.result()
+                print(f"Merge parent {name} done")
+            except Exception as e:
+                print(f"Parent merge {name} failed: {e}")
+                raise
+
+    # merging tweets
+    tasks["tweets"]()
+    print("Merge tweets done")
+
+    # running child tasks in parallel
+    with ThreadPoolExecutor(max_workers=max_workers) as ex:
+        child_futs = {ex.submit(tasks[name]): name for name in CHILD_TABLES}
+        for fut in as_completed(child_futs):
+            name = child_futs[fut]
+            try:
+                fut.result()
+                print(f"Merge child {name} done")
+            except Exception as e:
+                print(f"Child merge {name} failed: {e}")
+                raise
+
+
+def run_merge_plan(db_dsn, table_to_files: dict, index_map=None, max_workers=4):
+    """
+    Load the files of every table and merge them in dependency order, parallel
+    where possible. Each table takes a connection of MERGE_POOL (with the
+    bulk-load session settings) for its load and merge.
+    """
+    index_map = index_map or {}
+
+    tasks = {
+        name: partial(
+            load_table_files_to_db,
+            name,
+            table_to_files[name],
+            db_dsn,
+            index_map.get(name),
+            preceding_query_for(name),
+        )
+        for name in TABLE_COLS
+    }
+    run_in_dependency_order(tasks, max_workers=max_workers)
+
+
+# --------------------------
+# Import manifest
+# --------------------------
+# One row per input file. A file is "done" once every chunk of every work
+# unit planned from it has been merged; merges are idempotent, so files that
+# are still "running" after a crash are simply processed again by --resume.
+MANIFEST_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS import_manifest (
+        path TEXT PRIMARY KEY,
+        size BIGINT NOT NULL,
+        mtime DOUBLE PRECISION NOT NULL,
+        content_hash TEXT NOT NULL,
+        status TEXT NOT NULL,
+        row_counts JSONB,
+        parse_seconds DOUBLE PRECISION,
+        merge_seconds DOUBLE PRECISION,
+        started_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        finished_at TIMESTAMPTZ
+    );
+"""
+MANIFEST_HASH_SAMPLE = 1024 * 1024
+
+
+def file_fingerprint(path: str) -> Tuple[int, float, str]:
+    """Size, mtime and a BLAKE2b hash of the first and last MB of path."""
+    st = os.stat(path)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(str(st.st_size).encode())
+    with open(path, "rb") as fh:
+        h.update(fh.read(MANIFEST_HASH_SAMPLE))
+        if st.st_size > 2 * MANIFEST_HASH_SAMPLE:
+            fh.seek(-MANIFEST_HASH_SAMPLE, os.SEEK_END)
+            h.update(fh.read())
+    return st.st_size, st.st_mtime, h.hexdigest()
+
+
+def imported_files(db_dsn) -> Dict[str, Tuple[int, float, str]]:
+    """path -> (size, mtime, content hash) of the files the manifest records as done."""
+    conn = psycopg2.connect(db_dsn)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT EXISTS (SELECT 1 FROM tweets);")
+            if not cur.fetchone()[0]:
+                print("tweets is empty, ignoring the import manifest")
+                return {}
+            cur.execute(
+                "SELECT path, size, mtime, content_hash FROM import_manifest WHERE status = 'done';"
+            )
+            return {path: tuple(rest) for path, *rest in cur.fetchall()}
+    finally:
+        conn.close()
+
+
+def skip_imported_files(db_dsn, files: List[str]) -> List[str]:
+    """--resume: drop the files the manifest records as done and unchanged."""
+    done = imported_files(db_dsn)
+    remaining = []
+    for f in files:
+        recorded = done.get(os.path.abspath(f))
+        if recorded is None:
+            remaining.append(f)
+        elif recorded != file_fingerprint(f):
+            print(f"Resume: {f} changed since it was imported, importing it again")
+            remaining.append(f)
+    print(f"Resume: skipping {len(files) - len(remaining)} imported files")
+    return remaining
+
+
+class ImportManifest:
+    """
+    Tracks the work units of a run back to their input files and records
+    every file in import_manifest: "running" when the run starts, "done"
+    with its row counts and timings once its last chunk was merged.
+
+    Callers report each chunk handed to a merge (chunk_queued) and merged
+    (chunk_merged), the end marker of each unit (unit_ended) and its worker
+    stats (unit_stats); methods may be called from any thread.
+    """
+
+    def __init__(self, db_dsn, origins: Dict[Any, str], units: list):
+        self.db_dsn = db_dsn
+        self.lock = threading.Lock()
+        self.unit_file = {wid: os.path.abspath(origins[u]) for wid, u in enumerate(units, start=1)}
+        self.outstanding = {wid: 0 for wid in self.unit_file}
+        self.ended = set()
+        self.stats = {}
+        self.units_left = {}
+        for path in self.unit_file.values():
+            self.units_left[path] = self.units_left.get(path, 0) + 1
+        self.merge_seconds = {path: 0.0 for path in self.units_left}
+
+        conn = psycopg2.connect(db_dsn)
+        try:
+            with conn.cursor() as cur:
+                for path in self.units_left:
+                    cur.execute(
+                        """
+                        INSERT INTO import_manifest (path, size, mtime, content_hash, status)
+                        VALUES (%s, %s, %s, %s, 'running')
+                        ON CONFLICT (path) DO UPDATE SET
+                            size = EXCLUDED.size, mtime = EXCLUDED.mtime,
+                            content_hash = EXCLUDED.content_hash, status = 'running',
+                            row_counts = NULL, parse_seconds = NULL, merge_seconds = NULL,
+                            started_at = now(), finished_at = NULL;
+                        """,
+                        (path, *file_fingerprint(path)),
+                    )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def chunk_queued(self, wid: int) -> None:
+        with self.lock:
+            self.outstanding[wid] += 1
+
+    def chunk_merged(self, wid: int, seconds: float = 0.0) -> None:
+        with self.lock:
+            self.outstanding[wid] -= 1
+            self.merge_seconds[self.unit_file[wid]] += seconds
+        self._check(wid)
+
+    def unit_ended(self, wid: int) -> None:
+        with self.lock:
+            self.ended.add(wid)
+        self._check(wid)
+
+    def unit_stats(self, wid: int, stats: Dict[str, Any]) -> None:
+        with self.lock:
+            self.stats[wid] = stats
+        self._check(wid)
+
+    def _check(self, wid: int) -> None:
+        with self.lock:
+            if wid not in self.ended or wid not in self.stats or self.outstanding[wid]:
+                return
+            self.ended.discard(wid)
+            path = self.unit_file[wid]
+            self.units_left[path] -= 1
+            if self.units_left[path]:
+                return
+            unit_stats = [self.stats[w] for w, p in self.unit_file.items() if p == path]
+        self._mark_done(path, unit_stats)
+
+    def _mark_done(self, path: str, unit_stats: List[Dict[str, Any]]) -> None:
+        rows = {t: sum(s["rows"][t] for s in unit_stats) for t in TABLE_COLS}
+        conn = psycopg2.connect(self.db_dsn)
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    UPDATE import_manifest
+                    SET status = 'done', row_counts = %s, parse_seconds = %s,
+                        merge_seconds = %s, finished_at = now()
+                    WHERE path = %s;
+                    """,
+                    (
+                        json.dumps(rows),
+                        sum(s["seconds"] for s in unit_stats),
+                        self.merge_seconds[path],
+                        path,
+                    ),
+                )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def watch(self, futures: Dict[Any, int]) -> None:
+        """Hand the result of every worker future (future -> worker id) to unit_stats."""
+        for fut, wid in futures.items():
+            fut.add_done_callback(partial(self._future_done, wid))
+
+    def _future_done(self, wid: int, fut) -> None:
+        if not fut.cancelled() and fut.exception() is None:
+            self.unit_stats(wid, fut.result())
+
+
+def find_input_files(data_dir) -> List[str]:
+    files = []
+    data_dir = Path(data_dir)
+    for ext in ("*.jsonl", "*.jsonl.gz", "*.json"):
+        files.extend(sorted(str(p) for p in data_dir.glob(ext)))
+    return files
+
+
+def visible_at(db_dsn, paths: List[str]) -> Dict[str, float]:
+    """Epoch time at which the manifest marked each of paths done."""
+    conn = psycopg2.connect(db_dsn)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT path, extract(epoch FROM finished_at)
+                FROM import_manifest
+                WHERE status = 'done' AND path = ANY(%s);
+                """,
+                ([os.path.abspath(f) for f in paths],),
+            )
+            return {path: float(ts) for path, ts in cur.fetchall()}
+    finally:
+        conn.close()
+
+
+def watch_data_dir(args, run_iter) -> None:
+    """
+    --watch: poll DATA_DIR every --watch-interval seconds and import the new
+    files in micro-batches of up to --watch-batch files. A file is picked up
+    once its size and mtime did not change between two polls and it is at
+    least --watch-settle seconds old, so files still being written are left
+    alone. Files already in the manifest as done are skipped, and for every
+    loaded file the lag from its arrival until the manifest marked its rows
+    visible is reported. Arrival is the mtime, or the first poll that saw the
+    file when it was copied in with an older mtime.
+    """
+    print(f"Watching {DATA_DIR} every {args.watch_interval}s (Ctrl+C to stop)")
+    known = {p: (size, mtime) for p, (size, mtime, _) in imported_files(DB_DSN).items()}
+    last_poll = {}
+    first_seen = {}
+    attempts = {}
+    lags = []
+
+    try:
+        while True:
+            now = time.time()
+            ready = []
+            polled = {}
+            for f in find_input_files(DATA_DIR):
+                path = os.path.abspath(f)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                state = (st.st_size, st.st_mtime)
+                polled[path] = state
+                first_seen.setdefault(path, now)
+                if known.get(path) == state or attempts.get(path, 0) >= 3:
+                    continue
+                if last_poll.get(path) == state and now - st.st_mtime >= args.watch_settle:
+                    ready.append(path)
+            last_poll = polled
+
+            ready.sort(key=lambda f: polled[f][1])
+            for i in range(0, len(ready), args.watch_batch):
+                batch = ready[i : i + args.watch_batch]
+                print(f"\nWatch: importing {len(batch)} new files")
+                for f in batch:
+                    attempts[f] = attempts.get(f, 0) + 1
+                try:
+                    run_iter(args, batch)
+                    loaded = visible_at(DB_DSN, batch)
+                except Exception as e:
+                    # a failed merge (deadlock after retries, lost connection,
+                    # ...) fails the batch, not the daemon: its files stay
+                    # unknown and are retried like the ones a worker failed
+                    print(f"Watch: batch failed: {e!r}")
+                    loaded = {}
+
+                arrival = {f: max(polled[f][1], first_seen[f]) for f in batch}
+                for f in batch:
+                    if f in loaded:
+                        known[f] = polled[f]
+                        lags.append(loaded[f] - arrival[f])
+                    elif attempts[f] >= 3:
+                        print(f"Watch: giving up on {f} after {attempts[f]} attempts")
+                    else:
+                        print(f"Watch: {f} did not finish, retrying on the next poll")
+                batch_lags = [loaded[f] - arrival[f] for f in batch if f in loaded]
+                if batch_lags:
+                    print(
+                        f"Watch: {len(batch_lags)} files visible, lag "
+                        f"avg {sum(batch_lags) / len(batch_lags):.1f}s, max {max(batch_lags):.1f}s"
+                    )
+
+            time.sleep(args.watch_interval)
+    except KeyboardInterrupt:
+        print("\nWatch stopped")
+    if lags:
+        print(
+            f"Watch: imported {len(lags)} files, lag avg {sum(lags) / len(lags):.1f}s, max {max(lags):.1f}s"
+        )
+
+
+def _prepare_tmp_root(args) -> Path:
+    print("Temporary files will be written to", args.tmp_dir or "(temp dir)")
     tmp_root = (
         Path(args.tmp_dir)
         if args.tmp_dir
         else Path(tempfile.mkdtemp(prefix="tweet_import_"))
     )
-    tmp_root.mkdir(parents=True, exist_ok=True)
+    tmp_root.mkdir(parents=True, exist_ok=True)
+    return tmp_root
+
+
+def merge_chunk(args, chunk: Dict[str, str]) -> None:
+    """Merge one output chunk (table -> TSV path) and delete its files afterwards."""
+    table_files = {t: [chunk[t]] if t in chunk else [] for t in TABLE_COLS}
+
+    run_merge_plan(
+        DB_DSN,
+        table_to_files=table_files,
+        index_map=TMP_INDEX_MAP,
+        max_workers=args.workers,
+    )
+
+    for fp in chunk.values():
+        os.remove(fp)
+
+
+def _iter_frames(frames, futures, on_end: Optional[Callable[[int], None]] = None):
+    """
+    Yield (worker id, frame) until every submitted worker sent its end
+    marker; on_end is called with the worker id of every end marker.
+    """
+    pending = len(futures)
+    while pending:
+        try:
+            wid, frame = frames.get(timeout=1)
+        except queue.Empty:
+            # finished futures with end markers still missing mean a worker
+            # process died
+            if all(fut.done() for fut in futures):
+                raise RuntimeError("Workers exited without finishing their output")
+            continue
+
+        if frame is None:
+            pending -= 1
+            if on_end is not None:
+                on_end(wid)
+            continue
+        yield wid, frame
+
+
+def _discard_frames(frames, futures):
+    """Drain the frame queue until no worker can block on it any more."""
+    for fut in futures:
+        fut.cancel()
+    while True:
+        try:
+            frames.get(timeout=0.5)
+        except queue.Empty:
+            if all(fut.done() for fut in futures):
+                return
+
+
+def _put_while(q, item, alive: Callable[[], bool]) -> bool:
+    """Blocking put that gives up once the consumers of q are gone."""
+    while alive():
+        try:
+            q.put(item, timeout=1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+# Worker stats and stage utilization of every run_iter call, for the run report
+RUN_WORKER_STATS: List[Dict[str, Any]] = []
+RUN_STAGE_STATS: List[Dict[str, Any]] = []
+
+
+def _collect_worker_stats(futures) -> List[Dict[str, Any]]:
+    worker_stats = []
+    for fut in as_completed(futures):
+        fpath = futures[fut]
+        if fut.cancelled():
+            continue
+        try:
+            stats = fut.result()
+            stats["unit"] = fpath
+            worker_stats.append(stats)
+            print("Finished:", fpath)
+        except Exception as e:
+            print("Worker failed for", fpath, e)
+    RUN_WORKER_STATS.extend(worker_stats)
+    return worker_stats
+
+
+def print_worker_summary(worker_stats: List[Dict[str, Any]]):
+    """Print totals of the worker stats: lines read and parent rows deduplicated."""
+    lines = sum(s["lines"] for s in worker_stats)
+    bad_lines = sum(s["bad_lines"] for s in worker_stats)
+    print(f"\nLines read: {lines}, bad lines: {bad_lines}")
+
+    for t in PARENT_TABLES:
+        suppressed = sum(s["dedup_suppressed"].get(t, 0) for s in worker_stats)
+        evicted = sum(s["dedup_evicted"].get(t, 0) for s in worker_stats)
+        if suppressed or evicted:
+            print(
+                f"Duplicate {t} rows suppressed: {suppressed} (cache evictions: {evicted})"
+            )
+
+    skipped = sum(s.get("tweets_skipped", 0) for s in worker_stats)
+    if skipped:
+        evicted = sum(s.get("tweets_seen_evicted", 0) for s in worker_stats)
+        print(
+            f"Already extracted tweets skipped: {skipped} (cache evictions: {evicted})"
+        )
+
+    hits = sum(s["hashtag_id_hits"] for s in worker_stats)
+    misses = sum(s["hashtag_id_misses"] for s in worker_stats)
+    if hits or misses:
+        print(f"Hashtag ids computed: {misses}, served from memo: {hits}")
+
+    peaks = {}
+    for s in worker_stats:
+        peaks[s["pid"]] = max(peaks.get(s["pid"], 0), s["peak_rss"])
+    if peaks:
+        print(
+            f"Worker peak RSS: max {max(peaks.values()) / 2**20:.0f} MB, "
+            f"mean {sum(peaks.values()) / len(peaks) / 2**20:.0f} MB over {len(peaks)} processes"
+        )
+    over = sum(s["over_budget"] for s in worker_stats)
+    if over:
+        collections = [sum(s["gc_collections"][g] for s in worker_stats) for g in range(3)]
+        print(
+            f"Memory budget exceeded {over} times: gc generation 0/1/2 runs "
+            f"{collections[0]}/{collections[1]}/{collections[2]}, "
+            f"smallest batch {min(s['smallest_batch'] for s in worker_stats)} tweets"
+        )
+
+
+def print_stage_utilization(
+    wall: float,
+    workers: int,
+    worker_stats: List[Dict[str, Any]],
+    merge_threads: int = 0,
+    merge_busy: float = 0.0,
+    merge_idle: float = 0.0,
+):
+    """
+    Print how busy each pipeline stage was over the wall time of the run and
+    record it for the run report.
+    """
+    wall = max(wall, 1e-9)
+    parse_blocked = sum(s["blocked"] for s in worker_stats)
+    parse_busy = sum(s["seconds"] for s in worker_stats) - parse_blocked
+    parse_util = parse_busy / (workers * wall)
+    RUN_STAGE_STATS.append(
+        {
+            "wall_seconds": round(wall, 3),
+            "workers": workers,
+            "parse_utilization": round(parse_util, 3),
+            "parse_blocked_seconds": round(parse_blocked, 3),
+            "merge_threads": merge_threads,
+            "merge_busy_seconds": round(merge_busy, 3),
+            "merge_idle_seconds": round(merge_idle, 3),
+        }
+    )
+
+    print("\nStage utilization:")
+    print(
+        f"  parse: {parse_util:.0%} of {workers} workers busy, "
+        f"{parse_blocked:.1f}s blocked on a full queue"
+    )
+    if merge_threads:
+        merge_util = merge_busy / (merge_threads * wall)
+        print(
+            f"  merge: {merge_util:.0%} of {merge_threads} threads busy, "
+            f"{merge_idle:.1f}s waiting for chunks"
+        )
+        print(f"  bottleneck: {'merge' if merge_util > parse_util else 'parse'}")
+
+
+def merge_profiles(paths: List[str], out_path: str, top: int = 25) -> None:
+    """Merge the cProfile dumps of the workers into out_path and print the top functions."""
+    paths = [p for p in paths if os.path.exists(p)]
+    if not paths:
+        print("No worker profiles were written")
+        return
+    merged = pstats.Stats(*paths)
+    merged.dump_stats(out_path)
+    print(f"\nMerged {len(paths)} worker profiles into {out_path}, top {top} by own time:")
+    merged.sort_stats("tottime").print_stats(top)
+
+
+def git_commit() -> str:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+        )
+        return out.stdout.strip()
+    except OSError:
+        return ""
+
+
+def run_report(args, phases: Dict[str, float], report: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    JSON-ready summary of the run for --run-report: configuration, phase
+    seconds, worker counters (totals and per work unit), per-table COPY and
+    merge statistics, stage utilization and the integrity report.
+    """
+    workers = [{k: v for k, v in s.items() if k != "outputs"} for s in RUN_WORKER_STATS]
+    totals = {
+        k: sum(s[k] for s in workers)
+        for k in ("lines", "bad_lines", "frames", "blocked", "seconds")
+    }
+    for k in ("rows", "bytes"):
+        totals[k] = {t: sum(s[k][t] for s in workers) for t in TABLE_COLS}
+    tables = {}
+    for t, st in TABLE_STATS.items():
+        tables[t] = dict(st)
+        tables[t]["rows_per_second"] = st["rows"] / st["copy_seconds"] if st["copy_seconds"] else 0.0
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "config": {k: v for k, v in vars(args).items() if isinstance(v, (str, int, float, bool, type(None)))},
+        "phases": {k: round(v, 3) for k, v in phases.items()},
+        "workers": {"totals": totals, "units": workers},
+        "tables": tables,
+        "partitions": PARTITION_STATS,
+        "stages": RUN_STAGE_STATS,
+        "integrity": report,
+    }
+
+
+def write_run_report(path: str, run: Dict[str, Any]) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(run, f, indent=2)
+    print(f"Run report written to {path}")
+
+
+def start_iter(args, files):
+    """
+    Two-stage import pipeline: parse workers -> bounded merge queue -> merge threads.
+
+    Every work unit (file or shard, see plan_work_units) is submitted up front,
+    largest first, so an idle worker always pulls the next one from the pool's
+    shared queue and one big file no longer stalls the rest. Workers hand over each output chunk as
+    soon as it is written; chunks wait in a queue of --merge-queue-depth
+    entries until one of the --merge-threads threads merges it, so the database
+    works while Python parses and the unmerged data on disk stays capped.
+    """
+    tmp_root = _prepare_tmp_root(args)
+
+    origins = {}
+    units = plan_work_units(args, files, tmp_root, origins)
+    manifest = ImportManifest(DB_DSN, origins, units)
 
     print(
-        f"Processing {len(files)} files with {args.workers} workers; temporary CSVs in {tmp_root}"
+        f"Processing {len(files)} files as {len(units)} work units with {args.workers} workers; temporary CSVs in {tmp_root}"
     )
 
     file_processing_start = time.time()
-    per_worker_outputs = []
+    chunks = multiprocessing.Queue(maxsize=args.merge_queue_depth)
+    merge_q = queue.Queue(maxsize=args.merge_queue_depth)
+    merge_stats = {"busy": 0.0, "idle": 0.0}
+    stats_lock = threading.Lock()
+
+    def merge_loop():
+        while True:
+            wait_start = time.time()
+            item = merge_q.get()
+            merge_start = time.time()
+            if item is not None:
+                wid, chunk = item
+                merge_chunk(args, chunk)
+                manifest.chunk_merged(wid, time.time() - merge_start)
+            with stats_lock:
+                merge_stats["idle"] += merge_start - wait_start
+                merge_stats["busy"] += time.time() - merge_start
+            if item is None:
+                return
+
+    with ThreadPoolExecutor(max_workers=args.merge_threads) as mergers:
+        merge_futs = [mergers.submit(merge_loop) for _ in range(args.merge_threads)]
+        try:
+            with ProcessPoolExecutor(
+                max_workers=args.workers,
+                initializer=_init_worker,
+                initargs=(chunks, worker_options(args, stream=False)),
+            ) as ex:
+                unit_ids = {
+                    ex.submit(process_file_worker, (unit, wid, str(tmp_root))): wid
+                    for wid, unit in enumerate(units, start=1)
+                }
+                futures = {fut: describe_unit(units[wid - 1]) for fut, wid in unit_ids.items()}
+                manifest.watch(unit_ids)
+                try:
+                    for wid, chunk in _iter_frames(chunks, futures, manifest.unit_ended):
+                        manifest.chunk_queued(wid)
+                        # a merge thread only returns early when it failed
+                        if not _put_while(
+                            merge_q, (wid, chunk), lambda: not any(f.done() for f in merge_futs)
+                        ):
+                            _discard_frames(chunks, futures)
+                            break
+                except BaseException:
+                    _discard_frames(chunks, futures)
+                    raise
+
+                worker_stats = _collect_worker_stats(futures)
+        finally:
+            for _ in merge_futs:
+                _put_while(merge_q, None, lambda: not all(f.done() for f in merge_futs))
 
-    with ProcessPoolExecutor(max_workers=args.workers) as ex:
-        futures = {
-            ex.submit(process_file_worker, (fpath, wid, str(tmp_root))): (fpath, wid)
-            for wid, fpath in enumerate(files, start=1)
-        }
-        for fut in as_completed(futures):
-            fpath, _ = futures[fut]
-            try:
-                res = fut.result()
-                per_worker_outputs.append(res)
-                print("Finished:", fpath)
-            except Exception as e:
-                print("Worker failed for", fpath, e)
+        file_processing_end = time.time()
+        print(
+            f"File processing completed in {file_processing_end - file_processing_start:.1f} seconds"
+        )
+        for fut in merge_futs:
+            fut.result()
+
+    print_worker_summary(worker_stats)
+    print_stage_utilization(
+        time.time() - file_processing_start,
+        args.workers,
+        worker_stats,
+        merge_threads=args.merge_threads,
+        merge_busy=merge_stats["busy"],
+        merge_idle=merge_stats["idle"],
+    )
+    print_partition_summary()
+    print_table_summary()
 
-    file_processing_end = time.time()
+    shutil.rmtree(tmp_root / "decompressed", ignore_errors=True)
     print(
-        f"File processing completed in {file_processing_end - file_processing_start:.1f} seconds"
-    )
-
-    table_files = {}
-    tables = [
-        "users",
-        "places",
-        "tweets",
-        "hashtags",
-        "tweet_hashtag",
-        "tweet_urls",
-        "tweet_user_mentions",
-        "tweet_media",
-    ]
+        "Done. Bad lines (if any) were written to the per-worker bad_lines logs in:",
+        tmp_root,
+    )
 
-    # Index definitions for temp tables (for faster merge/update)
-    index_map = {
-        "users": [("users_tmp_idx", "(id)")],
-        "places": [("places_tmp_idx", "(id)")],
-        "tweets": [("tweets_tmp_idx", "(id)")],
-        "hashtags": [("hashtags_tmp_idx", "(id)")],
-        "tweet_hashtag": [("tweet_hashtag_tmp_idx", "(tweet_id, hashtag_id)")],
-        "tweet_urls": [("tweet_urls_tmp_idx", "(tweet_id, url)")],
-        "tweet_user_mentions": [
-            ("tweet_user_mentions_tmp_idx", "(tweet_id, mentioned_user_id)")
-        ],
-        "tweet_media": [("tweet_media_tmp_idx", "(tweet_id, media_id)")],
-    }
-    for t in tables:
-        table_files[t] = []
-    for outmap in per_worker_outputs:
-        for t, fp in outmap.items():
-            if os.path.exists(fp):
-                table_files[t].append(fp)
 
-    run_merge_plan(
-        DB_DSN,
-        table_to_files=table_files,
-        index_map=index_map,
-        max_workers=args.workers,
+def start_stream_iter(args, files):
+    """
+    --stream-copy counterpart of start_iter. Workers push row frames through a
+    bounded queue, the parent routes them to one StreamingTableLoader per table
+    and every --stream-segment-mb of data the COPYs are closed, merged in
+    dependency order and reopened. Only the bad lines logs touch the disk.
+    """
+    tmp_root = _prepare_tmp_root(args)
+    segment_bytes = args.stream_segment_mb * 1024 * 1024
+
+    origins = {}
+    units = plan_work_units(args, files, tmp_root, origins)
+    manifest = ImportManifest(DB_DSN, origins, units)
+    # worker ids of the frames in the open segment, merged by rotate_segment
+    segment_frames = []
+
+    print(
+        f"Streaming {len(files)} files as {len(units)} work units with {args.workers} workers straight into COPY"
+    )
+
+    file_processing_start = time.time()
+    frames = multiprocessing.Queue(maxsize=args.stream_queue_depth)
+    loaders = {}
+
+    def rotate_segment():
+        for loader in loaders.values():
+            loader.close_segment()
+        run_in_dependency_order(
+            {t: loader.merge for t, loader in loaders.items()},
+            max_workers=args.workers,
+        )
+        for wid in segment_frames:
+            manifest.chunk_merged(wid)
+        segment_frames.clear()
+
+    try:
+        for t in TABLE_COLS:
+            loaders[t] = StreamingTableLoader(
+                t,
+                DB_DSN,
+                args.stream_queue_depth,
+                TMP_INDEX_MAP.get(t),
+                preceding_query_for(t),
+            )
+            loaders[t].open_segment()
+
+        with ProcessPoolExecutor(
+            max_workers=args.workers,
+            initializer=_init_worker,
+            initargs=(frames, worker_options(args, stream=True)),
+        ) as ex:
+            unit_ids = {
+                ex.submit(process_file_worker, (unit, wid, str(tmp_root))): wid
+                for wid, unit in enumerate(units, start=1)
+            }
+            futures = {fut: describe_unit(units[wid - 1]) for fut, wid in unit_ids.items()}
+            manifest.watch(unit_ids)
+            try:
+                segment_size = 0
+                for wid, frame in _iter_frames(frames, futures, manifest.unit_ended):
+                    manifest.chunk_queued(wid)
+                    segment_frames.append(wid)
+                    for t, chunk in frame.items():
+                        loaders[t].feed(chunk)
+                        segment_size += len(chunk)
+
+                    if segment_size >= segment_bytes:
+                        rotate_segment()
+                        for loader in loaders.values():
+                            loader.open_segment()
+                        segment_size = 0
+            except BaseException:
+                _discard_frames(frames, futures)
+                raise
+
+            worker_stats = _collect_worker_stats(futures)
+
+        rotate_segment()
+    finally:
+        for loader in loaders.values():
+            loader.close()
+
+    print(
+        f"Streaming import completed in {time.time() - file_processing_start:.1f} seconds"
+    )
+    for t, loader in loaders.items():
+        print(f"Streamed {t}: {loader.rows} rows")
+
+    print_worker_summary(worker_stats)
+    print_stage_utilization(
+        time.time() - file_processing_start, args.workers, worker_stats
     )
+    print_partition_summary()
+    print_table_summary()
 
+    shutil.rmtree(tmp_root / "decompressed", ignore_errors=True)
     print(
         "Done. Bad lines (if any) were written to the per-worker bad_lines logs in:",
         tmp_root,
     )
 
 
-def get_missing_refs(conn, table: str, left_join: str, attr: str):
-    cur = conn.cursor()
+def export_parquet(args, files):
+    """
+    --sink parquet: run the extraction workers without the database and write
+    the eight tables as Parquet files, one per table and work unit, to
+    <--parquet-dir>/<table>/part-<n>.parquet. Parent rows are deduplicated
+    within a work unit only, so users, places and hashtags rows can repeat
+    across parts.
+    """
+    out_root = Path(args.parquet_dir)
+    if out_root.exists() and any(out_root.iterdir()):
+        print(f"--parquet-dir {out_root} is not empty")
+        sys.exit(1)
+    tmp_root = _prepare_tmp_root(args)
+    units = plan_work_units(args, files, tmp_root)
+    print(
+        f"Exporting {len(files)} files as {len(units)} work units with {args.workers} workers to {out_root}"
+    )
+
+    export_start = time.time()
+    with ProcessPoolExecutor(
+        max_workers=args.workers,
+        initializer=_init_worker,
+        initargs=(None, worker_options(args, stream=False)),
+    ) as ex:
+        futures = {
+            ex.submit(process_file_worker, (unit, wid, str(tmp_root))): describe_unit(unit)
+            for wid, unit in enumerate(units, start=1)
+        }
+        worker_stats = _collect_worker_stats(futures)
+
+    parts = {t: [] for t in TABLE_COLS}
+    for stats in worker_stats:
+        for frame in stats["outputs"]:
+            for t, path in frame.items():
+                dest = out_root / t / f"part-{len(parts[t]):05d}.parquet"
+                dest.parent.mkdir(parents=True, exist_ok=True)
+                shutil.move(path, dest)
+                parts[t].append(dest)
+    print(f"Parquet export completed in {time.time() - export_start:.1f} seconds")
+
+    print_worker_summary(worker_stats)
+    print("\nParquet tables:")
+    for t, paths in parts.items():
+        meta = [pq.ParquetFile(p).metadata for p in paths]
+        size = sum(os.path.getsize(p) for p in paths)
+        print(
+            f"  {t}: {sum(m.num_rows for m in meta)} rows in {len(paths)} files, "
+            f"{sum(m.num_row_groups for m in meta)} row groups, {size / 1e6:.1f} MB"
+        )
 
-    cur.execute(
-        f"""
-        SELECT COUNT(*)
-        FROM {table} t
-        LEFT JOIN {left_join} u ON t.{attr} = u.id
-        WHERE t.{attr} IS NOT NULL
-        AND u.id IS NULL;"""
+    shutil.rmtree(tmp_root / "decompressed", ignore_errors=True)
+    print(
+        "Done. Bad lines (if any) were written to the per-worker bad_lines logs in:",
+        tmp_root,
     )
 
-    count = cur.fetchone()[0]
 
-    cur.close()
-    return count
+def scan_input_files(args) -> List[str]:
+    """The input files in DATA_DIR, cut to --limit; exits when there are none."""
+    print("Scanning for input files in", DATA_DIR)
+    files = find_input_files(DATA_DIR)
+    print(f"Found {len(files)} input files")
+
+    if not files:
+        print("No input files found in", DATA_DIR)
+        sys.exit(1)
+
+    if args.limit > 0:
+        files = files[: args.limit]
+    return files
+
+
+def finish_instrumentation(args, phases: Dict[str, float], report: Optional[Dict[str, Any]] = None) -> None:
+    """Merge the worker profiles (--profile) and write the run report (--run-report)."""
+    if args.profile:
+        merge_profiles([s["profile"] for s in RUN_WORKER_STATS if "profile" in s], args.profile)
+    if args.run_report:
+        write_run_report(args.run_report, run_report(args, phases, report))
 
 
 # ---------- Main pipeline ----------
@@ -621,139 +3019,285 @@ def main():
         default=0,
         help="For testing: limit number of files to process",
     )
+    p.add_argument(
+        "--stream-copy",
+        action="store_true",
+        help="Stream worker rows straight into COPY FROM STDIN instead of writing per-worker TSV files",
+    )
+    p.add_argument(
+        "--stream-chunk-kb",
+        type=int,
+        default=1024,
+        help="With --stream-copy: size of the row frames a worker sends at once",
+    )
+    p.add_argument(
+        "--stream-queue-depth",
+        type=int,
+        default=16,
+        help="With --stream-copy: frames buffered per queue before workers block",
+    )
+    p.add_argument(
+        "--stream-segment-mb",
+        type=int,
+        default=512,
+        help="With --stream-copy: data streamed into the temp tables before they are merged",
+    )
+    p.add_argument(
+        "--chunk-mb",
+        type=int,
+        default=64,
+        help="Output a worker writes before handing the chunk over to be merged",
+    )
+    p.add_argument(
+        "--merge-queue-depth",
+        type=int,
+        default=4,
+        help="Chunks waiting to be merged before workers block",
+    )
+    p.add_argument(
+        "--merge-threads",
+        type=int,
+        default=2,
+        help="Threads merging chunks into the database concurrently",
+    )
+    p.add_argument(
+        "--shard-mb",
+        type=int,
+        default=256,
+        help="Split uncompressed inputs larger than this into line-aligned shards (0 disables)",
+    )
+    p.add_argument(
+        "--shard-gz",
+        action="store_true",
+        help="Decompress large .gz inputs once into --tmp-dir so they can be sharded too",
+    )
+    p.add_argument(
+        "--dedup-entries",
+        type=int,
+        default=100_000,
+        help="Per-worker LRU cache size (keys per parent table) for dropping duplicate users/places/hashtags rows (0 disables)",
+    )
+    p.add_argument(
+        "--merge-mode",
+        choices=("first", "latest"),
+        default="first",
+        help="first: keep the first row seen per key; latest: keep the newest users snapshot and the highest tweet retweet/favorite counts",
+    )
+    p.add_argument(
+        "--bulk-initial",
+        action="store_true",
+        help="Initial load into an empty database: load without keys/foreign keys/indexes and build them once at the end",
+    )
+    p.add_argument(
+        "--maintenance-workers",
+        type=int,
+        default=4,
+        help="With --bulk-initial: max_parallel_maintenance_workers for each key/index build",
+    )
+    p.add_argument(
+        "--tmp-index",
+        type=parse_tmp_index,
+        default=parse_tmp_index("none"),
+        help=(
+            "Temp table index strategy: none, before-copy, after-copy or sorted, "
+            "for all tables and/or per table, e.g. none,tweets=sorted "
+            "(bench_import.py tmp-index compares them)"
+        ),
+    )
+    p.add_argument(
+        "--merge-partitions",
+        type=int,
+        default=1,
+        help="Merge tweets and the child tables as this many hash partitions on parallel connections (1 disables)",
+    )
+    p.add_argument(
+        "--merge-work-mem",
+        default="256MB",
+        help="work_mem of the pooled merge connections",
+    )
+    p.add_argument(
+        "--merge-maintenance-work-mem",
+        default="1GB",
+        help="maintenance_work_mem of the pooled merge connections (temp table indexes)",
+    )
+    p.add_argument(
+        "--merge-temp-buffers",
+        default="256MB",
+        help="temp_buffers of the pooled merge connections, holding the per-table temp tables",
+    )
+    p.add_argument(
+        "--resume",
+        action="store_true",
+        help="Skip input files the import_manifest table records as fully merged and unchanged",
+    )
+    p.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep running and import new files as they land in DATA_DIR",
+    )
+    p.add_argument(
+        "--watch-interval",
+        type=float,
+        default=10.0,
+        help="With --watch: seconds between polls of DATA_DIR",
+    )
+    p.add_argument(
+        "--watch-settle",
+        type=float,
+        default=5.0,
+        help="With --watch: minimal age in seconds of a file's last modification before it is imported",
+    )
+    p.add_argument(
+        "--watch-batch",
+        type=int,
+        default=8,
+        help="With --watch: max number of files loaded per micro-batch",
+    )
+    p.add_argument(
+        "--copy-format",
+        choices=("csv", "binary"),
+        default="csv",
+        help="Format of the worker output and COPY: tab separated CSV or typed PostgreSQL binary",
+    )
+    p.add_argument(
+        "--timestamps",
+        choices=TIMESTAMP_FORMATS,
+        default="iso",
+        help="Form of the created_at values handed to COPY: the raw Twitter string, ISO 8601 "
+        "(cheaper for Postgres to parse) or epoch microseconds (needs --copy-format binary or --sink parquet)",
+    )
+    p.add_argument(
+        "--seen-tweets",
+        type=int,
+        default=200_000,
+        help="Per-worker LRU cache size (tweet ids) for skipping tweets, mostly retweeted/quoted ones, that were already extracted (0 disables)",
+    )
+    p.add_argument(
+        "--hashtag-id-version",
+        type=int,
+        choices=sorted(HASHTAG_ID_VERSIONS),
+        default=1,
+        help="Hashtag id scheme: 1 = SHA-256 (original), 2 = 8 byte BLAKE2b; must match the ids already stored",
+    )
+    p.add_argument(
+        "--batch-size",
+        type=int,
+        default=1000,
+        help="Tweets per worker row batch; the upper bound when --worker-memory-mb shrinks the batches",
+    )
+    p.add_argument(
+        "--worker-memory-mb",
+        type=int,
+        default=0,
+        help="Resident memory budget per worker; above it workers collect garbage, shrink their batches "
+        "and hand buffered output on (0: only track the peak)",
+    )
+    p.add_argument(
+        "--sink",
+        choices=("postgres", "parquet"),
+        default="postgres",
+        help="Load into Postgres, or export the normalized tables as Parquet files to --parquet-dir (needs pyarrow)",
+    )
+    p.add_argument("--parquet-dir", default="parquet", help="Output directory of --sink parquet, one subdirectory per table")
+    p.add_argument(
+        "--parquet-compression",
+        choices=("zstd", "snappy", "gzip", "none"),
+        default="zstd",
+        help="Compression codec of the Parquet files",
+    )
+    p.add_argument(
+        "--gz-reader",
+        choices=("auto",) + GZ_READERS,
+        default="auto",
+        help="Decompressor for .gz inputs; auto picks the fastest available (isal, zlib-ng, pigz, gzip)",
+    )
+    p.add_argument(
+        "--fast-report",
+        action="store_true",
+        help="Final report with row counts from table statistics and missing references estimated from a sample",
+    )
+    p.add_argument("--report-json", help="Also write the final report as JSON to this file")
+    p.add_argument(
+        "--run-report",
+        help="Write a JSON run report (config, phase timings, worker counters, per-table COPY/merge stats) to this file",
+    )
+    p.add_argument(
+        "--profile",
+        metavar="PATH",
+        help="Run the workers under cProfile and write their merged stats to PATH (pstats format)",
+    )
     args = p.parse_args()
-
-    # finding input files
-    print("Scanning for input files in", DATA_DIR)
-    files = []
-    data_dir = Path(DATA_DIR)
-    for ext in ("*.jsonl", "*.jsonl.gz", "*.json"):
-        files.extend(sorted(str(p) for p in data_dir.glob(ext)))
-    print(f"Found {len(files)} input files")
-
-    if not files:
-        print("No input files found in", DATA_DIR)
+    # every flag combination is checked before anything touches the database,
+    # so an invalid invocation leaves it as it was
+    if args.timestamps == "epoch" and args.copy_format == "csv" and args.sink == "postgres":
+        print("--timestamps epoch needs --copy-format binary or --sink parquet")
         sys.exit(1)
-
-    if args.limit > 0:
-        files = files[: args.limit]
-
-    if len(files) > args.workers:
-        iterations = math.floor(len(files) / args.workers)
-
-        for i in range(iterations):
-            iter_start = time.time()
-            print(f"Starting iteration {i+1} of {iterations}...")
-            print(f"Processing files {i*args.workers} to {(i+1)*args.workers - 1}...")
-            start_iter(args, files[i * args.workers : (i + 1) * args.workers])
-            iter_end = time.time()
-            print(f"Iteration {i+1} completed in {iter_end - iter_start:.1f} seconds.")
-    else:
-        print("Processing all files in a single iteration...")
-        start_iter(args, files)
-        print("All files processed.")
+    if args.sink == "parquet" and (args.watch or args.bulk_initial or args.resume or args.stream_copy):
+        print("--sink parquet cannot be combined with --watch, --bulk-initial, --resume or --stream-copy")
+        sys.exit(1)
+    if args.watch and args.bulk_initial:
+        print("--watch cannot be combined with --bulk-initial")
+        sys.exit(1)
+    try:
+        args.gz_reader = resolve_gz_reader(args.gz_reader)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+    print(f"Decompressing .gz inputs with {args.gz_reader}")
+
+    if args.sink == "parquet":
+        if pq is None:
+            print("--sink parquet needs pyarrow (pip install pyarrow)")
+            sys.exit(1)
+        export_parquet(args, scan_input_files(args))
+        finish_instrumentation(args, {"total": time.time() - start})
+        return
+
+    run_iter = start_stream_iter if args.stream_copy else start_iter
+    configure_merge(args)
+    open_merge_pool(DB_DSN, args)
+    prepare_database(DB_DSN)
+    check_hashtag_id_version(DB_DSN, args.hashtag_id_version)
+    if args.bulk_initial:
+        start_bulk_initial(DB_DSN)
+
+    if args.watch:
+        # one temp dir for all micro-batches instead of one per batch
+        args.tmp_dir = args.tmp_dir or tempfile.mkdtemp(prefix="tweet_import_")
+        watch_data_dir(args, run_iter)
+        print(f"Merge connections opened: {close_merge_pool()}")
+        finish_instrumentation(args, {"total": time.time() - start})
+        return
+
+    files = scan_input_files(args)
+    if args.resume:
+        files = skip_imported_files(DB_DSN, files)
+
+    phases = {"startup": time.time() - start}
+    load_start = time.time()
+    run_iter(args, files)
+    print("All files processed.")
+    print(f"Merge connections opened: {close_merge_pool()}")
+    phases["load"] = time.time() - load_start
+
+    if args.bulk_initial:
+        print(f"Phase load: {phases['load']:.1f} seconds")
+        finish_start = time.time()
+        finish_bulk_initial(DB_DSN, args)
+        phases["bulk_finish"] = time.time() - finish_start
 
     end = time.time()
+    phases["total"] = end - start
     print(f"Total time: {end - start:.2f} seconds")
 
-    # Printing final counts for each main table
-    conn = psycopg2.connect(DB_DSN)
-    try:
-        with conn.cursor() as cur:
-            tables = [
-                "users",
-                "places",
-                "tweets",
-                "hashtags",
-                "tweet_hashtag",
-                "tweet_urls",
-                "tweet_user_mentions",
-                "tweet_media",
-            ]
-            print("\nFinal row counts:")
-            for table in tables:
-                cur.execute(f"SELECT COUNT(*) FROM {table};")
-                count = cur.fetchone()[0]
-                print(f"{table}: {count}")
-
-            foreign_keys = (
-                "in_reply_to_status_id",
-                "quoted_status_id",
-                "retweeted_status_id",
-            )
-
-            for key in foreign_keys:
-                missing_ids = get_missing_refs(
-                    conn=conn, table="tweets", left_join="tweets", attr=key
-                )
-                print(f"missing_{key}_tweets: {missing_ids}")
-
-            cur.execute(
-                f"""
-                SELECT COUNT(*)
-                FROM tweets
-                WHERE user_id IS NULL;
-            """
-            )
-
-            tweet_user_id_null_count = cur.fetchone()[0]
-            print(f"tweet_user_id_null_count: {tweet_user_id_null_count}")
-
-            missing_tweet_user_ids = get_missing_refs(
-                conn=conn, table="tweets", left_join="users", attr="user_id"
-            )
-
-            print(f"missing_tweet_user_ids: {missing_tweet_user_ids}")
-
-            missing_user_mentions_tweet_ids = get_missing_refs(
-                conn=conn,
-                table="tweet_user_mentions",
-                left_join="tweets",
-                attr="tweet_id",
-            )
-
-            print(f"missing_user_mentions_tweet_ids: {missing_user_mentions_tweet_ids}")
-
-            missing_tweet_urls_tweet_id = get_missing_refs(
-                conn=conn,
-                table="tweet_urls",
-                left_join="tweets",
-                attr="tweet_id",
-            )
-
-            print(f"missing_tweet_urls_tweet_id: {missing_tweet_urls_tweet_id}")
-
-            missing_tweet_media_tweet_id = get_missing_refs(
-                conn=conn,
-                table="tweet_media",
-                left_join="tweets",
-                attr="tweet_id",
-            )
-
-            print(f"missing_tweet_media_tweet_id: {missing_tweet_media_tweet_id}")
-
-            missing_tweet_hashtag_tweet_id = get_missing_refs(
-                conn=conn,
-                table="tweet_hashtag",
-                left_join="tweets",
-                attr="tweet_id",
-            )
-
-            print(f"missing_tweet_hashtag_tweet_id: {missing_tweet_hashtag_tweet_id}")
-
-            missing_tweet_hashtag_hashtag_id = get_missing_refs(
-                conn=conn,
-                table="tweet_hashtag",
-                left_join="hashtags",
-                attr="hashtag_id",
-            )
-
-            print(
-                f"missing_tweet_hashtag_hashtag_id: {missing_tweet_hashtag_hashtag_id}"
-            )
-    finally:
-        conn.close()
-
+    # Final row counts and missing references
+    report = integrity_report(DB_DSN, fast=args.fast_report)
+    report["hashtag_id_collisions"] = len(HASHTAG_COLLISIONS)
+    print_report(report)
+    phases["report"] = report["seconds"]
+    if args.report_json:
+        write_report_json(report, args.report_json)
+    finish_instrumentation(args, phases, report)
 
 if __name__ == "__main__":
     main()
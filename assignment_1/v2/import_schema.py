@@ -1,11 +1,32 @@
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import psycopg2
 from dotenv import load_dotenv
 import os
 
 load_dotenv()
 
-# parser = argparse.ArgumentParser(description="Import SQL schema into PostgreSQL")
+parser = argparse.ArgumentParser(description="Import SQL schema into PostgreSQL")
 # parser.add_argument("--stage_table", action="store_true", help="Create staging table")
+parser.add_argument(
+    "--bulk-initial",
+    action="store_true",
+    help="Drop keys, foreign keys and indexes after creating the tables; import_data.py --bulk-initial builds them after the load",
+)
+
+# Tables of database_schema.sql whose constraints --bulk-initial defers
+SCHEMA_TABLES = (
+    "users",
+    "places",
+    "tweets",
+    "hashtags",
+    "tweet_hashtag",
+    "tweet_urls",
+    "tweet_user_mentions",
+    "tweet_media",
+)
 
 
 # args = parser.parse_args()
@@ -43,6 +64,114 @@ def import_schema(dbname, user, password, host="localhost", port=5432, sql_file=
         if conn is not None:
             conn.close()
 
+def defer_constraints(conn, tables=SCHEMA_TABLES) -> int:
+    """
+    Records the primary keys, unique constraints, foreign keys and secondary
+    indexes of the given tables in deferred_constraints and drops them, so an
+    initial bulk load into empty tables pays no index maintenance or FK checks.
+    Does nothing if constraints are already deferred. Returns the number of
+    deferred objects.
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS deferred_constraints (
+                table_name TEXT,
+                name TEXT,
+                kind CHAR,  -- p(rimary key), u(nique), f(oreign key), i(ndex)
+                definition TEXT
+            );
+            """
+        )
+        cur.execute("SELECT COUNT(*) FROM deferred_constraints;")
+        if cur.fetchone()[0]:
+            return 0
+
+        cur.execute(
+            """
+            INSERT INTO deferred_constraints
+            SELECT c.conrelid::regclass::text, c.conname, c.contype, pg_get_constraintdef(c.oid)
+            FROM pg_constraint c
+            WHERE c.contype IN ('p', 'u', 'f') AND c.conrelid::regclass::text = ANY(%s);
+
+            INSERT INTO deferred_constraints
+            SELECT i.tablename, i.indexname, 'i', i.indexdef
+            FROM pg_indexes i
+            WHERE i.schemaname = current_schema() AND i.tablename = ANY(%s)
+            AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conname = i.indexname);
+            """,
+            (list(tables), list(tables)),
+        )
+
+        # foreign keys first, they depend on the keys they reference
+        cur.execute(
+            "SELECT table_name, name, kind FROM deferred_constraints ORDER BY kind = 'f' DESC;"
+        )
+        deferred = cur.fetchall()
+        for table_name, name, kind in deferred:
+            if kind == "i":
+                cur.execute(f"DROP INDEX {name};")
+            else:
+                cur.execute(f"ALTER TABLE {table_name} DROP CONSTRAINT {name};")
+
+    conn.commit()
+    return len(deferred)
+
+
+def restore_constraints(db_dsn, workers=4, maintenance_workers=4, maintenance_work_mem="1GB"):
+    """
+    Rebuilds what defer_constraints dropped: keys and indexes in parallel
+    (each build may also use parallel maintenance workers), then foreign keys
+    as NOT VALID and their validation in parallel. Prints and returns the
+    seconds spent per phase.
+    """
+
+    def execute(sql):
+        conn = psycopg2.connect(db_dsn)
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cur:
+                cur.execute(f"SET max_parallel_maintenance_workers = {int(maintenance_workers)};")
+                cur.execute(f"SET maintenance_work_mem = '{maintenance_work_mem}';")
+                cur.execute(sql)
+        finally:
+            conn.close()
+
+    conn = psycopg2.connect(db_dsn)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT table_name, name, kind, definition FROM deferred_constraints;")
+            deferred = cur.fetchall()
+    finally:
+        conn.close()
+
+    keys = [f"ALTER TABLE {t} ADD CONSTRAINT {n} {d};" for t, n, k, d in deferred if k in ("p", "u")]
+    indexes = [f"{d};" for t, n, k, d in deferred if k == "i"]
+    fks = [(t, n, d) for t, n, k, d in deferred if k == "f"]
+
+    timings = {}
+
+    def phase(name, statements, parallel=True):
+        start = time.time()
+        if parallel:
+            with ThreadPoolExecutor(max_workers=workers) as ex:
+                list(ex.map(execute, statements))
+        else:
+            for sql in statements:
+                execute(sql)
+        timings[name] = time.time() - start
+        print(f"Phase {name}: {len(statements)} statements in {timings[name]:.1f} seconds")
+
+    phase("keys", keys)
+    phase("indexes", indexes)
+    # NOT VALID skips the scan but locks both tables, so these run one by one
+    phase("foreign keys", [f"ALTER TABLE {t} ADD CONSTRAINT {n} {d} NOT VALID;" for t, n, d in fks], parallel=False)
+    phase("validate", [f"ALTER TABLE {t} VALIDATE CONSTRAINT {n};" for t, n, d in fks])
+
+    execute("DROP TABLE deferred_constraints;")
+    return timings
+
+
 # def import_staging_table(dbname, user, password, host="localhost", port=5432):
 #     import_schema(dbname, user, password, host, port, sql_file="./schemas/staging_table.sql")
 
@@ -54,7 +183,7 @@ if __name__ == "__main__":
     HOST = os.getenv("DBHOST")
     PORT = os.getenv("DBPORT")
 
-    # args = parser.parse_args()
+    args = parser.parse_args()
 
     import_schema(
         dbname=DBNAME,
@@ -65,6 +194,14 @@ if __name__ == "__main__":
         sql_file="./schemas/database_schema.sql"
     )
 
+    if args.bulk_initial:
+        conn = psycopg2.connect(dbname=DBNAME, user=USER, password=PASSWORD, host=HOST, port=PORT)
+        try:
+            count = defer_constraints(conn)
+        finally:
+            conn.close()
+        print(f"✅ Deferred {count} constraints and indexes until import_data.py --bulk-initial finishes.")
+
     # if args.stage_table:
     #     import_staging_table(
     #         dbname=DBNAME,
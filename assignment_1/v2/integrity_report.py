@@ -0,0 +1,213 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+from dotenv import load_dotenv
+
+load_dotenv()
+
+parser = argparse.ArgumentParser(description="Row counts and missing references of the imported tables")
+parser.add_argument(
+    "--fast",
+    action="store_true",
+    help="Row counts from table statistics and missing references estimated from a sample",
+)
+parser.add_argument(
+    "--sample-pct",
+    type=float,
+    default=1.0,
+    help="With --fast: percentage of each source table sampled (TABLESAMPLE SYSTEM)",
+)
+parser.add_argument("--json", help="Write the report as JSON to this file")
+
+# Row counts printed in this order
+REPORT_TABLES = (
+    "users",
+    "places",
+    "tweets",
+    "hashtags",
+    "tweet_hashtag",
+    "tweet_urls",
+    "tweet_user_mentions",
+    "tweet_media",
+)
+
+# Source table -> checks computed by its single pass: report key -> (column,
+# referenced table). A reference is missing when the column is set but no row
+# of the referenced table has it as id.
+REFERENCE_CHECKS = {
+    "tweets": {
+        "missing_in_reply_to_status_id_tweets": ("in_reply_to_status_id", "tweets"),
+        "missing_quoted_status_id_tweets": ("quoted_status_id", "tweets"),
+        "missing_retweeted_status_id_tweets": ("retweeted_status_id", "tweets"),
+        "missing_tweet_user_ids": ("user_id", "users"),
+    },
+    "tweet_user_mentions": {
+        "missing_user_mentions_tweet_ids": ("tweet_id", "tweets"),
+    },
+    "tweet_urls": {
+        "missing_tweet_urls_tweet_id": ("tweet_id", "tweets"),
+    },
+    "tweet_media": {
+        "missing_tweet_media_tweet_id": ("tweet_id", "tweets"),
+    },
+    "tweet_hashtag": {
+        "missing_tweet_hashtag_tweet_id": ("tweet_id", "tweets"),
+        "missing_tweet_hashtag_hashtag_id": ("hashtag_id", "hashtags"),
+    },
+}
+
+# Further FILTER aggregates of a source table pass
+EXTRA_CHECKS = {
+    "tweets": {"tweet_user_id_null_count": "s.user_id IS NULL"},
+}
+
+# Order of the checks in the printed report
+REPORT_CHECKS = (
+    "missing_in_reply_to_status_id_tweets",
+    "missing_quoted_status_id_tweets",
+    "missing_retweeted_status_id_tweets",
+    "tweet_user_id_null_count",
+    "missing_tweet_user_ids",
+    "missing_user_mentions_tweet_ids",
+    "missing_tweet_urls_tweet_id",
+    "missing_tweet_media_tweet_id",
+    "missing_tweet_hashtag_tweet_id",
+    "missing_tweet_hashtag_hashtag_id",
+)
+
+
+def table_pass_sql(table: str, sample_pct: float = None) -> str:
+    """
+    One scan of table computing its row count and all of its checks as
+    FILTER aggregates, with one LEFT JOIN per reference (all on unique ids,
+    so rows are never multiplied).
+    """
+    aggregates = ["COUNT(*)"]
+    joins = []
+    for i, (key, (column, ref)) in enumerate(REFERENCE_CHECKS.get(table, {}).items()):
+        joins.append(f"LEFT JOIN {ref} r{i} ON r{i}.id = s.{column}")
+        aggregates.append(
+            f"COUNT(*) FILTER (WHERE s.{column} IS NOT NULL AND r{i}.id IS NULL) AS {key}"
+        )
+    for key, condition in EXTRA_CHECKS.get(table, {}).items():
+        aggregates.append(f"COUNT(*) FILTER (WHERE {condition}) AS {key}")
+    sample = f" TABLESAMPLE SYSTEM ({sample_pct})" if sample_pct else ""
+    return f"SELECT {', '.join(aggregates)} FROM {table} s{sample} {' '.join(joins)};"
+
+
+def check_keys(table: str) -> list:
+    return list(REFERENCE_CHECKS.get(table, {})) + list(EXTRA_CHECKS.get(table, {}))
+
+
+def estimated_row_counts(cur, tables) -> dict:
+    """
+    Row counts from pg_class, analyzing the tables that have no statistics
+    yet. Names are resolved with to_regclass, so a table of the same name in
+    another schema does not count.
+    """
+    cur.execute(
+        "SELECT t, c.reltuples::bigint FROM unnest(%s::text[]) t "
+        "JOIN pg_class c ON c.oid = to_regclass(t) AND c.relkind = 'r';",
+        (list(tables),),
+    )
+    counts = dict(cur.fetchall())
+    unknown = [t for t in tables if counts.get(t, -1) < 0]
+    for t in unknown:
+        cur.execute(f"ANALYZE {t};")
+    if unknown:
+        return estimated_row_counts(cur, tables)
+    return {t: counts[t] for t in tables}
+
+
+def integrity_report(db_dsn, fast: bool = False, sample_pct: float = 1.0, max_workers: int = 8) -> dict:
+    """
+    Row counts of REPORT_TABLES and the REFERENCE_CHECKS / EXTRA_CHECKS
+    counts. Every source table is scanned once, the scans run concurrently
+    on their own connections. With fast the row counts come from the table
+    statistics and the checks are extrapolated from a sample_pct sample.
+    """
+    start = time.time()
+
+    def run(sql):
+        conn = psycopg2.connect(db_dsn)
+        try:
+            with conn.cursor() as cur:
+                cur.execute(sql)
+                return cur.fetchone()
+        finally:
+            conn.close()
+
+    row_counts = {}
+    if fast:
+        conn = psycopg2.connect(db_dsn)
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cur:
+                row_counts = estimated_row_counts(cur, REPORT_TABLES)
+        finally:
+            conn.close()
+        scanned = list(REFERENCE_CHECKS)
+    else:
+        # tables without checks only need their count, still one query each
+        scanned = list(REPORT_TABLES)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as ex:
+        results = dict(
+            zip(
+                scanned,
+                ex.map(run, [table_pass_sql(t, sample_pct if fast else None) for t in scanned]),
+            )
+        )
+
+    checks = {}
+    for table, values in results.items():
+        sampled_rows, *counts = values
+        scale = 1.0
+        if fast:
+            scale = row_counts[table] / sampled_rows if sampled_rows else 0.0
+        else:
+            row_counts[table] = sampled_rows
+        for key, count in zip(check_keys(table), counts):
+            checks[key] = round(count * scale)
+
+    return {
+        "approximate": fast,
+        "row_counts": {t: row_counts[t] for t in REPORT_TABLES},
+        "checks": {k: checks[k] for k in REPORT_CHECKS},
+        "seconds": round(time.time() - start, 3),
+    }
+
+
+def print_report(report: dict) -> None:
+    suffix = " (approximate)" if report["approximate"] else ""
+    print(f"\nFinal row counts{suffix}:")
+    for table, count in report["row_counts"].items():
+        print(f"{table}: {count}")
+    for key, count in report["checks"].items():
+        print(f"{key}: {count}")
+    for key, value in report.items():
+        if key not in ("approximate", "row_counts", "checks", "seconds"):
+            print(f"{key}: {value}")
+    print(f"Integrity report took {report['seconds']:.1f} seconds")
+
+
+def write_report_json(report: dict, path: str) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Integrity report written to {path}")
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    dsn = (
+        f"dbname={os.getenv('DBNAME')} user={os.getenv('DBUSER')} password={os.getenv('DBPASS')} "
+        f"host={os.getenv('DBHOST')} port={os.getenv('DBPORT')}"
+    )
+    report = integrity_report(dsn, fast=args.fast, sample_pct=args.sample_pct)
+    print_report(report)
+    if args.json:
+        write_report_json(report, args.json)
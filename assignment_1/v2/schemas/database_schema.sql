@@ -11,7 +11,8 @@ CREATE UNLOGGED TABLE users (
     statuses_count INT,
     created_at TIMESTAMP,
     location TEXT,
-    url TEXT
+    url TEXT,
+    snapshot_at TIMESTAMP -- created_at of the tweet this profile snapshot came with
 );
 
 CREATE UNLOGGED TABLE places (